@@ -4,12 +4,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import folium
 from folium.plugins import MarkerCluster
+from longtable_loader import GroupIndex, get_dataset_version
+from render_cache import render_cache
 
 # Load the CSV files
 file_path = '/Users/sinugp/Downloads/solara-dropdown.csv'
 id_file_path = '/Users/sinugp/Downloads/test_longtable_line.csv'
 data = pd.read_csv(file_path)
 id_data = pd.read_csv(id_file_path)
+dataset_version = (get_dataset_version(file_path), get_dataset_version(id_file_path))
 
 # Extract unique states and IDs
 unique_states = data['state'].unique().tolist()
@@ -18,6 +21,10 @@ unique_ids = id_data['Id'].unique().tolist()
 # Merge the dataframes to ensure we have both IDs and other relevant data
 merged_data = pd.merge(data, id_data, on='Id', how='inner')
 
+# Index the merged rows by ID (with names and states) and by name once, so selections do not rescan the table
+id_index = GroupIndex(merged_data, 'Id', 'Name_x', 'state')
+name_index = GroupIndex(merged_data, 'Name_x', None)
+
 # Reactive variables
 selected_id = solara.reactive(unique_ids[0])
 selected_state = solara.reactive("")
@@ -26,17 +33,12 @@ generate_trigger = solara.reactive(0)
 
 # Function to update state and name based on selected ID
 def update_state_and_name(id):
-    filtered_data = merged_data[merged_data['Id'] == id]
-    if not filtered_data.empty:
-        selected_state.value = filtered_data['state'].iloc[0]
-        selected_name.value = filtered_data['Name_x'].iloc[0]
-    else:
-        selected_state.value = ""
-        selected_name.value = ""
+    selected_state.value = id_index.first_state(id)
+    selected_name.value = id_index.first_name(id)
 
 # Function to filter data based on selected state and ID
 def get_filtered_names(state, id):
-    filtered_names = merged_data[(merged_data['state'] == state) & (merged_data['Id'] == id)]['Name_x'].unique().tolist()
+    filtered_names = id_index.get_names(id, state)
     if filtered_names:
         selected_name.value = filtered_names[0]
     return filtered_names
@@ -117,10 +119,12 @@ def View():
     with solara.VBox() as main:
         if generate_trigger.value > 0 and selected_name.value:
             m = plot_map(merged_data, highlight_name=selected_name.value)
-            fig = plot_bar_chart(merged_data, selected_name.value)
-            if fig:
+            # Repeat views of the same name reuse the rendered image instead of redrawing
+            chart_png = render_cache.render((dataset_version, 'bar', selected_name.value),
+                                            lambda: plot_bar_chart(name_index.rows(selected_name.value), selected_name.value))
+            if chart_png:
                 solara.HTML(tag="div", unsafe_innerHTML=m._repr_html_())
-                solara.FigureMatplotlib(fig)
+                solara.Image(chart_png)
                 solara.Info("Map and chart have been updated.")
             else:
                 solara.Warning("No data available for the selected state and name.")
@@ -1,36 +1,41 @@
-import zarr
-import s3fs
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+from rivid_index import load_rivid_index, lookup_river_indices
+from store_pool import forecast_bucket_url, forget_store, get_filesystem, get_forecast_url, open_forecast_group
+from manifest import get_river_checksums, get_store_fingerprint, get_store_version, load_manifest, save_manifest
+from ensemble_stats import compute_ensemble_stats
+from forecast_cube import ForecastCubeWriter
+from io_metrics import export_json, export_prometheus, timed
+from parallel_ingest import cube_to_frame, ingest_parallel
+from forecast_io import get_ensemble_columns, read_time_array, write_forecast_dataset, write_forecast_csv
 
 def get_forecast_data(river_number, date):
-    # Define the S3 bucket and Zarr path
-    s3_bucket_url = f's3://geoglows-v2-forecasts/{date}.zarr/'
-
-    # Initialize S3 filesystem
-    s3 = s3fs.S3FileSystem(anon=True)
-
     try:
-        # Use fsspec to map the S3 URL
-        mapper = s3fs.S3Map(root=s3_bucket_url, s3=s3, check=False)
-
-        # Open the Zarr group
-        zarr_group = zarr.open_group(mapper, mode='r')
-
-        # Locate the river number index
-        rivid_array = zarr_group['rivid'][:]
-        if river_number in rivid_array:
-            river_index = list(rivid_array).index(river_number)
-            # Extract the forecast data using the index
-            qout_array = zarr_group['Qout'][:, :, river_index]
-            time_array = zarr_group['time'][:]
-            ensemble_array = zarr_group['ensemble'][:]
+        # Get the pooled Zarr group for the date, opening it on first use
+        zarr_group = open_forecast_group(date)
+
+        # Locate the river number index using the cached rivid lookup table
+        with timed('rivid_lookup', date=date, river=river_number):
+            river_index = lookup_river_indices(load_rivid_index(zarr_group, get_forecast_url(date)), [river_number])[0]
+        if river_index >= 0:
+            # Extract the forecast data using the index (chunk download and decompression)
+            with timed('qout_read', date=date, river=river_number):
+                qout_array = zarr_group['Qout'][:, :, river_index]
+                time_array = read_time_array(zarr_group)
+                ensemble_array = zarr_group['ensemble'][:]
             
-            # Construct a DataFrame
-            forecast_df = pd.DataFrame(qout_array, columns=time_array)
-            forecast_df.index = [f"ensemble_{i}" for i in ensemble_array]
-            forecast_df.columns = time_array
-            forecast_df = forecast_df.transpose()
+            with timed('dataframe', date=date, river=river_number):
+                # Construct a DataFrame
+                forecast_df = pd.DataFrame(qout_array, columns=time_array)
+                forecast_df.index = [f"ensemble_{i}" for i in ensemble_array]
+                forecast_df.columns = time_array
+                forecast_df = forecast_df.transpose()
+
+                # Add the per-timestep ensemble statistics next to the raw members
+                for name, values in compute_ensemble_stats(qout_array, axis=0).items():
+                    forecast_df[name] = values
             
             return forecast_df
         else:
@@ -39,62 +44,285 @@ def get_forecast_data(river_number, date):
         print(f"Error accessing data for RiverNumber {river_number} on {date}: {e}")
         return pd.DataFrame()
 
+def get_forecast_data_many(river_numbers, date, raise_errors=False):
+    try:
+        # Get the pooled Zarr group for the date once for all rivers
+        zarr_group = open_forecast_group(date)
+
+        # Resolve every river number to its index with one vectorized lookup
+        river_numbers = np.asarray(river_numbers)
+        with timed('rivid_lookup', date=date):
+            river_indices = lookup_river_indices(load_rivid_index(zarr_group, get_forecast_url(date)), river_numbers)
+        found = river_indices >= 0
+        if not found.any():
+            return pd.DataFrame()
+        river_numbers = river_numbers[found]
+        river_indices = river_indices[found]
+
+        # Read all requested Qout columns at once; sorted unique indices let zarr
+        # fetch each chunk along the rivid axis only once
+        with timed('qout_read', date=date):
+            unique_indices, inverse = np.unique(river_indices, return_inverse=True)
+            qout_array = zarr_group['Qout'].get_orthogonal_selection((slice(None), slice(None), unique_indices))
+            qout_array = qout_array[:, :, inverse]
+            time_array = read_time_array(zarr_group)
+            ensemble_array = zarr_group['ensemble'][:]
+
+        with timed('dataframe', date=date):
+            # Construct one tidy frame: a row per (river, time), a column per ensemble member
+            n_ensembles, n_times, n_rivers = qout_array.shape
+            values = qout_array.transpose(2, 1, 0).reshape(n_rivers * n_times, n_ensembles)
+            forecast_df = pd.DataFrame(values, columns=[f"ensemble_{i}" for i in ensemble_array])
+            forecast_df.index = np.tile(time_array, n_rivers)
+
+            # Add the per-timestep ensemble statistics for all rivers in one vectorized pass
+            for name, stat_array in compute_ensemble_stats(qout_array, axis=0).items():
+                forecast_df[name] = stat_array.T.ravel()
+            forecast_df['RiverNumber'] = np.repeat(river_numbers, n_times)
+            forecast_df['Date'] = date
+
+        return forecast_df
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(f"Error accessing data for {len(river_numbers)} RiverNumbers on {date}: {e}")
+        return pd.DataFrame()
+
+def get_forecast_data_range(river_numbers, dates, max_workers=8, batch_size=1000, retries=2):
+    # Split the rivers into batches and queue one job per (date, river batch)
+    river_numbers = list(river_numbers)
+    jobs = [(date, river_numbers[start:start + batch_size], 0)
+            for date in dates
+            for start in range(0, len(river_numbers), batch_size)]
+
+    # Keep at most max_workers jobs in flight and yield each result as soon as it finishes
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        jobs = iter(jobs)
+        retry_jobs = []
+
+        def submit_next():
+            job = retry_jobs.pop() if retry_jobs else next(jobs, None)
+            if job is not None:
+                date, batch, attempt = job
+                pending[executor.submit(get_forecast_data_many, batch, date, raise_errors=True)] = job
+
+        for _ in range(max_workers):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                date, batch, attempt = pending.pop(future)
+                try:
+                    forecast_df = future.result()
+                except Exception as e:
+                    # A failed batch is retried, and raised once its retries are used up so no rivers go missing silently
+                    if attempt >= retries:
+                        print(f"Giving up on {len(batch)} RiverNumbers on {date} after {attempt + 1} attempts: {e}")
+                        raise
+                    print(f"Retrying {len(batch)} RiverNumbers on {date} after error: {e}")
+                    retry_jobs.append((date, batch, attempt + 1))
+                    forecast_df = None
+                submit_next()
+                if forecast_df is not None and not forecast_df.empty:
+                    yield date, forecast_df
+
+def iter_forecast_batches(river_numbers, date, batch_size=1000):
+    # Fetch the rivers a batch at a time so only one batch is held in memory
+    river_numbers = list(river_numbers)
+    for start in range(0, len(river_numbers), batch_size):
+        forecast_df = get_forecast_data_many(river_numbers[start:start + batch_size], date)
+        if not forecast_df.empty:
+            yield forecast_df
+
+def parallel_forecast_batches(river_numbers, date, batch_size=1000, n_workers=None):
+    # Read every river on a process pool into shared memory, then hand it on one batch at a time,
+    # so only a batch is ever copied out of the cube; the block is freed once the last batch is taken
+    with ingest_parallel(river_numbers, date, n_workers=n_workers, batch_size=batch_size) as shared_cube:
+        for start in range(0, len(shared_cube.river_numbers), batch_size):
+            stop = start + batch_size
+            forecast_df = cube_to_frame(shared_cube.values[start:stop], shared_cube.river_numbers[start:stop],
+                                        shared_cube.time_array, shared_cube.ensemble_array, date)
+            if not forecast_df.empty:
+                yield forecast_df
+
+def cube_forecast_batches(batches, cube_path):
+    # Copy each raw batch into the memory-mappable cube on its way through, publishing the cube at the end
+    writer = ForecastCubeWriter(cube_path)
+    for forecast_df in batches:
+        writer.append(forecast_df)
+        yield forecast_df
+    writer.close()
+
+def clean_forecast_batches(batches):
+    # Remove rows where every ensemble member is NaN from each batch as it passes through
+    for forecast_df in batches:
+        cleaned_df = forecast_df.dropna(how='all', subset=get_ensemble_columns(forecast_df))
+        if not cleaned_df.empty:
+            yield cleaned_df
+
+def write_forecast_batches(batches, dataset_path, csv_path=None):
+    # Write each batch to the dataset as soon as it arrives, so a crashed run keeps every finished batch
+    n_batches, n_rows = 0, 0
+    for forecast_df in batches:
+        with timed('write'):
+            write_forecast_dataset(forecast_df, dataset_path)
+            if csv_path:
+                write_forecast_csv(forecast_df, csv_path, append=n_batches > 0)
+        n_batches += 1
+        n_rows += len(forecast_df)
+        print(f"Wrote batch {n_batches} ({forecast_df['RiverNumber'].nunique()} rivers, {len(forecast_df)} rows)")
+    return n_batches, n_rows
+
+def run_incremental(river_numbers, dataset_path, manifest_path=None, batch_size=1000, verify=False, recheck_dates=3, max_dates=None):
+    # Load the manifest of (date, river) pairs already written, kept next to the dataset by default
+    manifest_path = manifest_path or os.path.join(dataset_path, '_manifest.json')
+    manifest = load_manifest(manifest_path)
+
+    # River numbers read from a CSV with blank rows come in as floats; the manifest is keyed by their integer value
+    river_numbers = [int(river_number) for river_number in pd.Series(river_numbers, dtype='float64').dropna()]
+    river_keys = [str(river_number) for river_number in river_numbers]
+
+    # Find the published forecast dates, oldest first; with an empty manifest every one of them is ingested,
+    # so max_dates keeps only the newest ones (older dates are then never fetched)
+    dates = sorted(item.split('/')[-1].replace('.zarr', '') for item in list_s3_contents(forecast_bucket_url) if item.endswith('.zarr'))
+    if max_dates:
+        dates = dates[-max_dates:]
+
+    # The newest dates are the ones likely to be republished, so they get a cheap version check every run
+    recent_dates = set(dates[-recheck_dates:]) if recheck_dates else set()
+    for date in dates:
+        entry = manifest['dates'].get(date)
+        finished = entry and entry.get('complete') and set(river_keys) <= set(entry['rivers'])
+
+        # Older finished dates are skipped without touching the bucket; verify re-checks every date in full
+        if finished and not verify and date not in recent_dates:
+            continue
+
+        # Recent finished dates cost one metadata request: an unchanged ETag or modification time skips them
+        version = get_store_version(date)
+        if finished and not verify and version is not None and version == entry.get('version'):
+            continue
+
+        # A changed store fingerprint means the date was republished: refetch it and compare river checksums
+        fingerprint = get_store_fingerprint(date)
+        if entry is None:
+            entry = {'fingerprint': fingerprint, 'rivers': {}, 'previous_rivers': {}}
+        elif entry['fingerprint'] != fingerprint:
+            print(f"Forecast {date} changed since it was processed, checking it again")
+            forget_store(get_forecast_url(date))
+            entry = {'fingerprint': fingerprint, 'rivers': {}, 'previous_rivers': {**entry.get('previous_rivers', {}), **entry['rivers']}}
+        entry['version'] = version
+        manifest['dates'][date] = entry
+
+        todo = [river_number for river_number, key in zip(river_numbers, river_keys) if key not in entry['rivers']]
+        if not todo:
+            entry['complete'] = True
+            save_manifest(manifest, manifest_path)
+            continue
+        print(f"Processing {len(todo)} missing RiverNumbers for Date: {date}")
+
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            # Errors stop the run here so the batch is retried next time instead of being marked done
+            forecast_df = get_forecast_data_many(batch, date, raise_errors=True)
+            checksums = get_river_checksums(forecast_df) if not forecast_df.empty else {}
+
+            # Write only rivers whose content is new or differs from what was written before
+            changed = [int(key) for key, checksum in checksums.items() if entry['previous_rivers'].get(key) != checksum]
+            if changed:
+                changed_df = forecast_df[forecast_df['RiverNumber'].isin(changed)]
+                changed_df = changed_df.dropna(how='all', subset=get_ensemble_columns(changed_df))
+                if not changed_df.empty:
+                    with timed('write', date=date):
+                        write_forecast_dataset(changed_df, dataset_path)
+
+            # Record the batch, with rivers missing from the store marked so they are not asked for again
+            for river_number in batch:
+                entry['rivers'][str(river_number)] = checksums.get(str(river_number))
+            save_manifest(manifest, manifest_path)
+            print(f"Wrote {len(changed)} of {len(batch)} RiverNumbers for Date: {date}")
+
+        entry['complete'] = True
+        entry['previous_rivers'] = {}
+        save_manifest(manifest, manifest_path)
+    return manifest
+
 def list_s3_contents(bucket_url):
-    # Initialize S3 filesystem
-    s3 = s3fs.S3FileSystem(anon=True)
+    # Get the pooled filesystem for the bucket
+    fs = get_filesystem(bucket_url)
 
     try:
-        # List contents of the bucket
-        contents = s3.ls(bucket_url)
+        # List contents of the bucket, skipping any listing cached earlier in the process
+        fs.invalidate_cache(bucket_url)
+        with timed('list', store=bucket_url):
+            contents = fs.ls(bucket_url)
         return contents
     except Exception as e:
         print(f"Error accessing S3 bucket: {e}")
         return []
 
-# Load the CSV file to get the list of RiverNumber
-csv_file_path = '/Users/sinugp/Downloads/altair_points_with_river_numbers.csv'
-try:
-    df_rivers = pd.read_csv(csv_file_path)
-    river_numbers = df_rivers['RiverNumber'].tolist()[:5]  # Limit to the first 5 river numbers
-    print(f"Loaded {len(river_numbers)} river numbers from CSV file.")
-except Exception as e:
-    print(f"Error reading CSV file: {e}")
-    river_numbers = []
-
-# Get the list of available dates from the S3 bucket
-s3_bucket_url = 's3://geoglows-v2-forecasts/'
-dates = [item.split('/')[-1].replace('.zarr', '') for item in list_s3_contents(s3_bucket_url) if item.endswith('.zarr')]
-
-# Take the first date for analysis
-selected_date = dates[0]
-print(f"Selected date for analysis: {selected_date}")
-
-# Initialize a list to hold the forecast data
-forecast_data_list = []
-
-# Retrieve forecast data for each river number for the selected date
-for river_number in tqdm(river_numbers, desc="Processing river numbers"):
-    print(f"Processing RiverNumber: {river_number}, Date: {selected_date}")
-    forecast_df = get_forecast_data(river_number, selected_date)
-    if not forecast_df.empty:
-        # Add river number and date as columns
-        forecast_df['RiverNumber'] = river_number
-        forecast_df['Date'] = selected_date
-        forecast_data_list.append(forecast_df)
-
-# Combine all the forecast data into a single DataFrame for analysis
-if forecast_data_list:
-    combined_forecast_data = pd.concat(forecast_data_list, ignore_index=True)
-    
-    # Clean the DataFrame by removing rows with all NaN values
-    cleaned_forecast_data = combined_forecast_data.dropna(how='all')
-    
-    # Save the cleaned forecast data to a CSV file
-    output_csv_file_path = '/Users/sinugp/Downloads/forecast_data.csv'
-    cleaned_forecast_data.to_csv(output_csv_file_path, index=False)
-    print(f"Forecast data saved to {output_csv_file_path}")
-    
-    # Display the cleaned forecast data
-    print(cleaned_forecast_data.head())
-else:
-    print("No forecast data collected.")
\ No newline at end of file
+if __name__ == '__main__':
+    # Also write the flat CSV export next to the Parquet dataset
+    export_csv = False
+
+    # Number of rivers fetched and written per batch
+    batch_size = 1000
+
+    # Only fetch forecasts and rivers missing from the manifest of earlier runs
+    incremental = False
+
+    # Newest forecast dates an incremental run looks at; None ingests every date in the bucket on the first run
+    incremental_max_dates = 7
+
+    # Also build the memory-mapped forecast cube used by the dashboards
+    build_cube = True
+
+    # Read the rivers on a process pool into shared memory instead of batch by batch in this process
+    parallel = False
+
+    # Load the CSV file to get the list of RiverNumber
+    csv_file_path = '/Users/sinugp/Downloads/altair_points_with_river_numbers.csv'
+    try:
+        df_rivers = pd.read_csv(csv_file_path)
+        # Points the geocoder could not resolve have a blank RiverNumber
+        river_numbers = df_rivers['RiverNumber'].dropna().astype('int64').tolist()[:5]  # Limit to the first 5 river numbers
+        print(f"Loaded {len(river_numbers)} river numbers from CSV file.")
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+        river_numbers = []
+
+    output_dataset_path = '/Users/sinugp/Downloads/forecast_data'
+    if incremental:
+        run_incremental(river_numbers, output_dataset_path, batch_size=batch_size, max_dates=incremental_max_dates)
+    else:
+        # Get the list of available dates from the S3 bucket
+        dates = [item.split('/')[-1].replace('.zarr', '') for item in list_s3_contents(forecast_bucket_url) if item.endswith('.zarr')]
+
+        # Take the first date for analysis
+        selected_date = dates[0]
+        print(f"Selected date for analysis: {selected_date}")
+
+        # Stream the forecast data batch by batch: fetch, clean, then write
+        print(f"Processing {len(river_numbers)} RiverNumbers, Date: {selected_date}")
+        output_csv_file_path = '/Users/sinugp/Downloads/forecast_data.csv' if export_csv else None
+        if parallel:
+            batches = parallel_forecast_batches(river_numbers, selected_date, batch_size=batch_size)
+        else:
+            batches = iter_forecast_batches(river_numbers, selected_date, batch_size=batch_size)
+        if build_cube:
+            output_cube_path = f'/Users/sinugp/Downloads/forecast_cube/{selected_date}'
+            batches = cube_forecast_batches(batches, output_cube_path)
+        batches = clean_forecast_batches(batches)
+        n_batches, n_rows = write_forecast_batches(batches, output_dataset_path, output_csv_file_path)
+
+        if n_batches:
+            print(f"Forecast data saved to {output_dataset_path} ({n_rows} rows)")
+            if output_csv_file_path:
+                print(f"Forecast data exported to {output_csv_file_path}")
+        else:
+            print("No forecast data collected.")
+
+    # Save the I/O report for this run as JSON and in the Prometheus text format
+    export_json('/Users/sinugp/Downloads/forecast_io_report.json')
+    export_prometheus('/Users/sinugp/Downloads/forecast_io_report.prom')
@@ -1,18 +1,30 @@
-import pandas as pd
+import io
+import html
 import solara
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import numpy as np
 import folium
 from folium.plugins import TimestampedGeoJson
+from downsample import downsample_frame, get_figure_width
+from longtable_loader import GroupIndex, get_dataset_version, load_long_table
+from map_features import TimestampedFeatures
+from render_cache import render_cache
 
 # Load the CSV file
 file_path = 'fc_20240429.csv'
-data = pd.read_csv(file_path)
+data, warning_level_values = load_long_table(file_path)
+dataset_version = get_dataset_version(file_path)
 
 # Extract unique IDs
 unique_ids = data['Id'].unique().tolist()
 
+# Index the rows and names of each ID once, so selections do not rescan the table
+id_index = GroupIndex(data)
+
+# Map features of every row, built once with vectorized binning and string formatting
+map_features = TimestampedFeatures(data, id_index)
+
 # Reactive variables
 selected_id = solara.reactive(unique_ids[0])
 selected_name = solara.reactive("")
@@ -21,15 +33,11 @@ show_values = solara.reactive(False)
 
 # Function to update name based on selected ID
 def update_state_and_name(id):
-    filtered_data = data[data['Id'] == id]
-    if not filtered_data.empty:
-        selected_name.value = filtered_data['Name'].iloc[0]
-    else:
-        selected_name.value = ""
+    selected_name.value = id_index.first_name(id)
 
 # Function to filter data based on selected ID
 def get_filtered_names(id):
-    filtered_names = data[data['Id'] == id]['Name'].unique().tolist()
+    filtered_names = id_index.get_names(id)
     if filtered_names:
         selected_name.value = filtered_names[0]
     return filtered_names
@@ -41,27 +49,27 @@ def plot_line_chart(df, id, show_values):
         print("No data available for the selected ID.")
         return None
     
-    # Ensure date is in datetime format
-    filtered_data['date'] = pd.to_datetime(filtered_data['date'])
-    
     fig, ax1 = plt.subplots(figsize=(10, 6))
     ax2 = ax1.twinx()  # Instantiate a second y-axis that shares the same x-axis
     
-    line, = ax1.plot(filtered_data['date'], filtered_data['value'], marker='o', linestyle='-', color='blue', label='Value')
+    # Keep only the points the chart width can show, with each bucket's peak and trough
+    plot_data = downsample_frame(filtered_data, 'date', 'value', width_px=get_figure_width(fig))
+    marker = 'o' if len(plot_data) == len(filtered_data) else None
+    line, = ax1.plot(plot_data['date'], plot_data['value'], marker=marker, linestyle='-', color='blue', label='Value')
     ax1.set_xlabel('Date', fontweight='bold')
     ax1.set_ylabel('Value', fontweight='bold')
     ax1.set_title(f'Value over Time for ID {id}', fontweight='bold')
     ax1.grid(True)
     
-    # Add all dates to x-axis
-    ax1.set_xticks(filtered_data['date'])
-    ax1.set_xticklabels(filtered_data['date'].dt.strftime('%Y-%m-%d'), rotation=45, ha='right')
+    # One tick per day, however many readings each day holds
     ax1.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    plt.setp(ax1.get_xticklabels(), rotation=45, ha='right')
     
-    # Conditionally add value annotations next to each point
+    # Conditionally add value annotations next to each plotted point
     if show_values:
-        for i, txt in enumerate(filtered_data['value']):
-            ax1.annotate(f"{txt:.2f}", (filtered_data['date'].iloc[i], filtered_data['value'].iloc[i]), 
+        for i, txt in enumerate(plot_data['value']):
+            ax1.annotate(f"{txt:.2f}", (plot_data['date'].iloc[i], plot_data['value'].iloc[i]), 
                          textcoords="offset points", xytext=(0,5), ha='center')
     
     plt.subplots_adjust(right=0.7, top=0.95, bottom=0.25)  # Adjust the top, right, and bottom of the graph
@@ -77,8 +85,8 @@ def plot_line_chart(df, id, show_values):
     }
     
     for level, (linestyle, color, short_name) in warning_levels.items():
-        if level in df.columns:
-            value = df[level].unique()[0]
+        if id in warning_level_values.index and level in warning_level_values.columns:
+            value = warning_level_values.at[id, level]
             ax2.axhline(y=value, color=color, linestyle=linestyle, label=short_name)
     
     # Adjust legend positioning to the top right
@@ -105,93 +113,58 @@ def add_legend(m):
      '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
+# Placeholder in the map's stylesheet that a highlight rule replaces
+highlight_placeholder = '/* highlight */'
+
 # Function to plot map with timeline slider
-def plot_map_with_slider(df, highlight_id=None):
+def plot_map_with_slider(features):
     # Create a map centered around the mean coordinates with a specific zoom level
-    m = folium.Map(location=[df['YCoordinate'].mean(), df['XCoordinate'].mean()], zoom_start=4)
-    
-    # Define a function to determine color based on value
-    def get_color(value):
-        if value < 10:
-            return 'green'
-        elif 10 <= value < 20:
-            return 'blue'
-        elif 20 <= value < 30:
-            return 'orange'
-        else:
-            return 'red'
+    m = folium.Map(location=features.center, zoom_start=4)
 
-    # Define a function to determine radius based on value
-    def get_radius(value):
-        if value < 10:
-            return 8
-        else:
-            return 10
-
-    features = []
-    for i, row in df.iterrows():
-        feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [row['XCoordinate'], row['YCoordinate']]
-            },
-            'properties': {
-                'time': row['date'],
-                'popup': f"ID: {row['Id']} - {row['Name']}: ({row['XCoordinate']}, {row['YCoordinate']}) Value: {row['value']}",
-                'icon': 'circle',
-                'iconstyle': {
-                    'color': get_color(row['value']),
-                    'fillColor': get_color(row['value']),
-                    'fillOpacity': 0.6,
-                    'radius': get_radius(row['value'])
-                }
-            }
-        }
-        if highlight_id and row['Id'] == highlight_id:
-            # Adding blinking effect for the highlighted ID
-            feature['properties']['iconstyle']['className'] = 'blinking'
-        features.append(feature)
-    
-    TimestampedGeoJson({
-        'type': 'FeatureCollection',
-        'features': features
-    }, period='P1D', add_last_point=True, auto_play=False, loop=False).add_to(m)
+    # Features are serialized once at load, each marker tagged with a class name for its ID
+    TimestampedGeoJson(io.StringIO(features.to_json()), period='P1D', add_last_point=True, auto_play=False, loop=False).add_to(m)
 
     # Add legend to the map
     add_legend(m)
 
-    # Add CSS for blinking effect
-    blinking_css = '''
+    # Add CSS for blinking effect; the rule for the highlighted ID's markers goes in place of the placeholder
+    blinking_css = f'''
     <style>
-    .blinking {
-        animation: blinker 1s linear infinite;
-    }
-    @keyframes blinker {
-        50% { opacity: 0; }
-    }
+    @keyframes blinker {{
+        50% {{ opacity: 0; }}
+    }}
+    {highlight_placeholder}
     </style>
     '''
     m.get_root().html.add_child(folium.Element(blinking_css))
 
     return m
 
+_base_map_html = None
+
+# Function to get the map HTML for a highlight: the page is rendered once and a highlight only fills in its CSS rule
+def get_map_html(highlight_id=None):
+    global _base_map_html
+    if _base_map_html is None:
+        _base_map_html = plot_map_with_slider(map_features)._repr_html_()
+    return _base_map_html.replace(highlight_placeholder, html.escape(map_features.highlight_css(highlight_id)), 1)
+
 # Components
 @solara.component
 def View():
     with solara.VBox() as main:
         if generate_trigger.value > 0 and selected_id.value:
-            m = plot_map_with_slider(data, highlight_id=selected_id.value)
-            fig = plot_line_chart(data, selected_id.value, show_values.value)
-            if fig:
-                solara.HTML(tag="div", unsafe_innerHTML=m._repr_html_())
-                solara.FigureMatplotlib(fig)
+            # Repeat views of the same ID and options reuse the rendered image instead of redrawing
+            chart_png = render_cache.render((dataset_version, 'line', selected_id.value, show_values.value),
+                                            lambda: plot_line_chart(id_index.rows(selected_id.value), selected_id.value, show_values.value))
+            if chart_png:
+                solara.HTML(tag="div", unsafe_innerHTML=get_map_html(selected_id.value))
+                solara.Image(chart_png)
                 solara.Info("Map and chart have been updated.")
             else:
                 solara.Warning("No data available for the selected ID.")
         else:
-            m = plot_map_with_slider(data)
-            solara.HTML(tag="div", unsafe_innerHTML=m._repr_html_())
+            solara.HTML(tag="div", unsafe_innerHTML=get_map_html())
             solara.Warning("Please select an ID.")
     return main
 
@@ -2,13 +2,12 @@ import pandas as pd
 import solara
 import altair as alt
 from vega_datasets import data as vega_data
+from downsample import downsample_frame
+from longtable_loader import load_long_table
 
-# Load the CSV file
+# Load the CSV file with typed columns (dates are parsed once by the loader)
 file_path = '/Users/sinugp/Downloads/test_longtable_line.csv'  # Adjusted path for your uploaded file
-data = pd.read_csv(file_path)
-
-# Convert date column to datetime
-data['date'] = pd.to_datetime(data['date'])
+data, warning_level_values = load_long_table(file_path)
 
 # Extract unique IDs from CSV
 unique_ids = data['Id'].unique().tolist()
@@ -25,6 +24,9 @@ def plot_line_chart(df, selected_id, selected_name):
         print("No data available for the selected Id and Name.")
         return None
 
+    # Keep only the points an 800 px wide chart can show, with each bucket's peak and trough
+    filtered_data = downsample_frame(filtered_data, 'date', 'value', width_px=800)
+
     # Create the line chart
     lines = alt.Chart(filtered_data).mark_line().encode(
         x=alt.X('date:T', title='Date'),
@@ -1,15 +1,19 @@
+import os
+import json
 import pandas as pd
 import solara
 import matplotlib.pyplot as plt
 import numpy as np
 import altair as alt
-from vega_datasets import data
+from longtable_loader import GroupIndex, get_dataset_version
+from render_cache import render_cache
 
 # Load the CSV files
 file_path = '/Users/sinugp/Downloads/solara-dropdown.csv'
 id_file_path = '/Users/sinugp/Downloads/test_longtable_line.csv'
 data_df = pd.read_csv(file_path)
 id_data = pd.read_csv(id_file_path)
+dataset_version = (get_dataset_version(file_path), get_dataset_version(id_file_path))
 
 # Extract unique states and IDs from the ID file
 unique_ids = id_data['Id'].unique().tolist()
@@ -17,6 +21,9 @@ unique_ids = id_data['Id'].unique().tolist()
 # Merge the dataframes to ensure we have both IDs and other relevant data
 merged_data = pd.merge(data_df, id_data, on='Id', how='inner')
 
+# Index the merged rows by ID, with their names and states, once so selections do not rescan the table
+id_index = GroupIndex(merged_data, 'Id', 'Name_x', 'state')
+
 # Filter to ensure coordinates fall within Africa's bounding box
 # Approximate bounding box for Africa: latitudes [-35, 37], longitudes [-20, 55]
 africa_bbox = merged_data[
@@ -43,17 +50,12 @@ generate_trigger = solara.reactive(0)
 
 # Function to update state and name based on selected ID
 def update_state_and_name(id):
-    filtered_data = merged_data[merged_data['Id'] == id]
-    if not filtered_data.empty:
-        selected_state.value = filtered_data['state'].iloc[0]
-        selected_name.value = filtered_data['Name_x'].iloc[0]
-    else:
-        selected_state.value = ""
-        selected_name.value = ""
+    selected_state.value = id_index.first_state(id)
+    selected_name.value = id_index.first_name(id)
 
 # Function to filter data based on selected state and ID
 def get_filtered_names(state, id):
-    filtered_names = merged_data[(merged_data['state'] == state) & (merged_data['Id'] == id)]['Name_x'].unique().tolist()
+    filtered_names = id_index.get_names(id, state)
     if filtered_names:
         selected_name.value = filtered_names[0]
     return filtered_names
@@ -84,63 +86,81 @@ def plot_bar_chart(df, name):
     fig.tight_layout()  # Adjust layout to make room for rotated x-tick labels
     return fig
 
+# Natural Earth 110m countries bundled in public/world-110m.json; Solara serves public/ under /static/public,
+# so the base map loads from the app's own server and works offline
+world_topojson_url = os.environ.get('RIVER_ID_WORLD_TOPOJSON_URL', '/static/public/world-110m.json')
+
+# Colour scale shared by the point and highlight layers
+value_bin_scale = alt.Scale(domain=['0-5', '5-10', '10-15', '15-20', '20-25'], range=['purple', 'blue', 'green', 'yellow', 'red'])
+
+point_tooltip = [
+    alt.Tooltip('XCoordinate_x:Q', title='Longitude'),
+    alt.Tooltip('YCoordinate_x:Q', title='Latitude'),
+    alt.Tooltip('IDs:N', title='IDs'),
+    alt.Tooltip('avg_value:Q', title='Average Value'),
+    alt.Tooltip('Name_x:N', title='Names')
+]
+
+_base_map = None
+
+# Function to build the static country layer once and reuse it on every render
+def get_base_map():
+    global _base_map
+    if _base_map is None:
+        # The countries come from the topojson bundled in public/, referenced by URL so it is not inlined in the spec
+        world = alt.topo_feature(world_topojson_url, 'countries')
+
+        # Create base map
+        _base_map = alt.Chart(world).mark_geoshape(
+            stroke='white',
+            strokeWidth=0.5
+        ).encode(
+            color=alt.value('lightgray'),
+            tooltip=[alt.Tooltip('properties.name:N', title='Country')]
+        ).properties(
+            width=800,
+            height=600
+        ).project(
+            type='mercator',
+            center=[20, 0],  # Center on Africa
+            scale=300  # Adjust scale to show entire Africa
+        )
+    return _base_map
+
 # Function to plot map using Altair
-def plot_map(df, highlight_id=None):
-    world = alt.topo_feature(data.world_110m.url, 'countries')
-
-    # Create base map
-    map_chart = alt.Chart(world).mark_geoshape(
-        stroke='white',
-        strokeWidth=0.5
-    ).encode(
-        color=alt.value('lightgray'),
-        tooltip=[alt.Tooltip('id:Q', title='Country')]
-    ).properties(
-        width=800,
-        height=600
-    ).project(
-        type='mercator',
-        center=[20, 0],  # Center on Africa
-        scale=300  # Adjust scale to show entire Africa
-    )
+def plot_map(df, highlight_id=None, shared_data=True):
+    map_chart = get_base_map()
+
+    # With shared_data the points are stored once at the top of the spec and both layers refer to them
+    layer_data = alt.Undefined if shared_data else df
 
     # Data points layer
-    points = alt.Chart(df).mark_circle().encode(
+    points = alt.Chart(layer_data).mark_circle().encode(
         longitude='XCoordinate_x:Q',
         latitude='YCoordinate_x:Q',
         size=alt.Size('avg_value:Q', title='Average Value', scale=alt.Scale(range=[50, 500])),
-        color=alt.Color('value_bin:N', scale=alt.Scale(domain=['0-5', '5-10', '10-15', '15-20', '20-25'], range=['purple', 'blue', 'green', 'yellow', 'red'])),
-        tooltip=[
-            alt.Tooltip('XCoordinate_x:Q', title='Longitude'),
-            alt.Tooltip('YCoordinate_x:Q', title='Latitude'),
-            alt.Tooltip('IDs:N', title='IDs'),
-            alt.Tooltip('avg_value:Q', title='Average Value'),
-            alt.Tooltip('Name_x:N', title='Names')
-        ]
+        color=alt.Color('value_bin:N', scale=value_bin_scale),
+        tooltip=point_tooltip
     )
+    layers = [map_chart, points]
 
-    # Highlighted points layer if an ID is provided
+    # Highlighted points layer if an ID is provided, selected by a filter on the same data
     if highlight_id:
-        highlight = df[df['IDs'].str.contains(str(highlight_id))]
-        highlight_chart = alt.Chart(highlight).mark_circle(
+        highlight_chart = alt.Chart(layer_data).mark_circle(
             size=500
         ).encode(
             longitude='XCoordinate_x:Q',
             latitude='YCoordinate_x:Q',
-            color=alt.Color('value_bin:N', scale=alt.Scale(domain=['0-5', '5-10', '10-15', '15-20', '20-25'], range=['purple', 'blue', 'green', 'yellow', 'red'])),
-            tooltip=[
-                alt.Tooltip('XCoordinate_x:Q', title='Longitude'),
-                alt.Tooltip('YCoordinate_x:Q', title='Latitude'),
-                alt.Tooltip('IDs:N', title='IDs'),
-                alt.Tooltip('avg_value:Q', title='Average Value'),
-                alt.Tooltip('Name_x:N', title='Names')
-            ]
+            color=alt.Color('value_bin:N', scale=value_bin_scale),
+            tooltip=point_tooltip
+        ).transform_filter(
+            f"indexof(split(datum.IDs, ', '), {json.dumps(str(highlight_id))}) >= 0"
         )
-        map_chart = map_chart + points + highlight_chart
-    else:
-        map_chart = map_chart + points
-    
-    return map_chart
+        layers.append(highlight_chart)
+
+    if shared_data:
+        return alt.layer(*layers, data=df)
+    return alt.layer(*layers)
 
 # Components
 @solara.component
@@ -148,10 +168,12 @@ def View():
     with solara.VBox() as main:
         if generate_trigger.value > 0 and selected_name.value:
             map_chart = plot_map(grouped_data, highlight_id=selected_id.value)
-            fig = plot_bar_chart(africa_bbox, selected_name.value)
-            if fig:
+            # Repeat views of the same name reuse the rendered image instead of redrawing
+            chart_png = render_cache.render((dataset_version, 'africa_bar', selected_name.value),
+                                            lambda: plot_bar_chart(africa_bbox, selected_name.value))
+            if chart_png:
                 solara.AltairChart(chart=map_chart)
-                solara.FigureMatplotlib(fig)
+                solara.Image(chart_png)
                 solara.Info("Map and chart have been updated.")
             else:
                 solara.Warning("No data available for the selected state and name.")
@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import zarr
+
+# Function to write a local Zarr store with the same layout as the GeoGLOWS forecasts
+def make_synthetic_store(store_path, n_rivers, n_times=85, n_ensembles=51, river_chunk=4096, date='2024040100', seed=0):
+    rng = np.random.default_rng(seed)
+    zarr_group = zarr.open_group(store_path, mode='w')
+
+    # River IDs are shuffled like the real rivid array, so lookups cannot rely on order
+    rivid = rng.permutation(np.arange(110000000, 110000000 + n_rivers, dtype=np.int64))
+    zarr_group.array('rivid', rivid, chunks=(n_rivers,))
+    time_array = zarr_group.array('time', np.arange(n_times, dtype=np.int64) * 3 * 3600, chunks=(n_times,))
+    time_array.attrs['units'] = f'seconds since {date[:4]}-{date[4:6]}-{date[6:8]} {date[8:]}:00:00'
+    zarr_group.array('ensemble', np.arange(1, n_ensembles + 1, dtype=np.int32), chunks=(n_ensembles,))
+
+    # Qout[ensemble, time, rivid], chunked along rivid, filled one chunk at a time to keep memory flat
+    qout = zarr_group.zeros('Qout', shape=(n_ensembles, n_times, n_rivers), chunks=(n_ensembles, n_times, river_chunk), dtype=np.float32)
+    for start in range(0, n_rivers, river_chunk):
+        stop = min(start + river_chunk, n_rivers)
+        base = rng.gamma(2.0, 20.0, size=(1, 1, stop - start))
+        qout[:, :, start:stop] = (base * rng.lognormal(0.0, 0.3, size=(n_ensembles, n_times, stop - start))).astype(np.float32)
+    zarr.consolidate_metadata(zarr_group.store)
+    return rivid
+
+# Function to time a call a few times and keep the best and median wall time
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'best_s': min(timings), 'median_s': float(np.median(timings)), 'repeat': repeat}
+
+# Function to reset every cache so the next read starts cold
+def reset_caches(cache_dir):
+    import store_pool
+    import chunk_cache
+    import rivid_index
+    store_pool.clear_pool()
+    rivid_index.clear_loaded_indexes()
+    chunk_cache._disk_indexes.clear()
+    chunk_cache._disk_bytes.clear()
+    chunk_cache._written_since_scan.clear()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def run_benchmarks(args, bucket_path, cache_dir):
+    import RiverDF
+    import parallel_ingest
+
+    dates = [f'202404{day:02d}00' for day in range(1, args.n_dates + 1)]
+    rivid = None
+    for date in dates:
+        rivid = make_synthetic_store(os.path.join(bucket_path, f'{date}.zarr'), args.n_rivers, args.n_times,
+                                     river_chunk=args.river_chunk, date=date)
+
+    rng = np.random.default_rng(1)
+    results = []
+
+    def record(name, river_count, timing, **extra):
+        results.append({'benchmark': name, 'rivers': river_count, **timing, **extra})
+        print(f"{name:<24} rivers={river_count:<7} best={timing['best_s']:.4f}s median={timing['median_s']:.4f}s")
+
+    for river_count in args.river_counts:
+        rivers = rng.choice(rivid, size=min(river_count, len(rivid)), replace=False).tolist()
+
+        # Single-river reads, one call per river as the original script did
+        single = rivers[:args.single_limit]
+        reset_caches(cache_dir)
+        RiverDF.get_forecast_data(single[0], dates[0])
+        record('single_river_loop', len(single),
+               time_call(lambda: [RiverDF.get_forecast_data(river, dates[0]) for river in single], args.repeat))
+
+        # Batched read, cold (empty pool and chunk cache) and then warm
+        reset_caches(cache_dir)
+        record('many_river_cold', len(rivers), time_call(lambda: RiverDF.get_forecast_data_many(rivers, dates[0]), 1))
+        record('many_river_warm', len(rivers), time_call(lambda: RiverDF.get_forecast_data_many(rivers, dates[0]), args.repeat))
+
+        # Warm pool but chunks read from the on-disk cache only
+        def warm_disk():
+            import store_pool
+            store_pool.clear_pool()
+            RiverDF.get_forecast_data_many(rivers, dates[0])
+        record('many_river_disk_cache', len(rivers), time_call(warm_disk, args.repeat))
+
+        # Several dates fetched concurrently
+        reset_caches(cache_dir)
+        record('multi_date_range', len(rivers),
+               time_call(lambda: list(RiverDF.get_forecast_data_range(rivers, dates, max_workers=args.workers)), 1),
+               dates=len(dates))
+
+        # Process-pool ingestion into shared memory
+        if args.parallel:
+            reset_caches(cache_dir)
+            record('parallel_ingest', len(rivers),
+                   time_call(lambda: parallel_ingest.ingest_parallel(rivers, dates[0], n_workers=args.workers).close(), 1))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark forecast ingestion against a synthetic GeoGLOWS-shaped Zarr store')
+    parser.add_argument('--n-rivers', type=int, default=100000)
+    parser.add_argument('--n-times', type=int, default=85)
+    parser.add_argument('--n-dates', type=int, default=3)
+    parser.add_argument('--river-chunk', type=int, default=4096)
+    parser.add_argument('--river-counts', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--single-limit', type=int, default=20, help='Cap on rivers timed through the single-river loop')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--parallel', action='store_true', help='Also time the process-pool ingestion')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--workdir', default=None, help='Folder for the synthetic stores and caches (temporary by default)')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='river_id_bench_')
+    bucket_path = os.path.join(workdir, 'bucket')
+    cache_dir = os.path.join(workdir, 'cache')
+
+    # Point the pools and caches at the synthetic bucket before the ingest modules read their settings
+    os.environ['FORECAST_BUCKET_URL'] = bucket_path
+    os.environ['RIVER_ID_CACHE_DIR'] = cache_dir
+    try:
+        results = run_benchmarks(args, bucket_path, cache_dir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'workdir')},
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'zarr': zarr.__version__,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Benchmark results saved to {args.output}")
+    return report
+
+if __name__ == '__main__':
+    main()
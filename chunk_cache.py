@@ -0,0 +1,190 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+from fsspec.mapping import FSMap
+from zarr.storage import BaseStore
+from rivid_index import cache_dir
+
+# Byte budget for cached chunks on disk, 0 turns the cache off
+max_cache_bytes = int(os.environ.get('RIVER_ID_CHUNK_CACHE_BYTES', 4 * 1024 ** 3))
+
+# Share of the budget a process may write before it re-reads the folder, so files written by other processes
+# sharing the folder count against the same budget
+rescan_share = 0.05
+
+_disk_indexes = {}
+_disk_bytes = {}
+_written_since_scan = {}
+_lock = threading.RLock()
+
+# Function to read the files under a cache folder into its LRU index, oldest access first, keeping the same index object
+def _scan_disk(chunk_dir):
+    entries = []
+    for root, _, files in os.walk(chunk_dir):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, os.path.join(root, name), stat.st_size))
+    entries.sort()
+    index = _disk_indexes.setdefault(chunk_dir, OrderedDict())
+    index.clear()
+    index.update((path, size) for _, path, size in entries)
+    _disk_bytes[chunk_dir] = sum(size for _, _, size in entries)
+    _written_since_scan[chunk_dir] = 0
+    return index
+
+# Function to get the LRU index of files under a cache folder, scanning the folder on first use
+def _get_disk_index(chunk_dir):
+    with _lock:
+        if chunk_dir not in _disk_indexes:
+            _scan_disk(chunk_dir)
+        return _disk_indexes[chunk_dir]
+
+# Function to drop every cached key of one store, e.g. after the remote store was republished
+def clear_cached_store(store_path, chunk_dir=None):
+    chunk_dir = chunk_dir or os.path.join(cache_dir, 'chunks')
+    store_dir = os.path.join(chunk_dir, hashlib.sha1(store_path.encode()).hexdigest())
+    index = _get_disk_index(chunk_dir)
+    with _lock:
+        for path in [path for path in index if os.path.dirname(path) == store_dir]:
+            _disk_bytes[chunk_dir] -= index.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class ChunkCache(BaseStore):
+    # Read-through on-disk cache in front of any fsspec mapper, shared LRU across stores in one folder
+
+    def __init__(self, mapper, store_path=None, chunk_dir=None, max_bytes=None):
+        self.mapper = mapper
+        self.store_path = store_path or getattr(mapper, 'root', str(id(mapper)))
+        self.chunk_dir = chunk_dir or os.path.join(cache_dir, 'chunks')
+        self.max_bytes = max_cache_bytes if max_bytes is None else max_bytes
+        self.store_dir = os.path.join(self.chunk_dir, hashlib.sha1(self.store_path.encode()).hexdigest())
+        self.index = _get_disk_index(self.chunk_dir)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_fetched = 0
+
+    def _path(self, key):
+        return os.path.join(self.store_dir, quote(key, safe=''))
+
+    def _read_cached(self, key):
+        path = self._path(key)
+        with _lock:
+            if path not in self.index:
+                return None
+            self.index.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            with _lock:
+                _disk_bytes[self.chunk_dir] -= self.index.pop(path, 0)
+            return None
+        os.utime(path)
+        return value
+
+    def _write_cached(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        with _lock:
+            _disk_bytes[self.chunk_dir] += len(value) - self.index.get(path, 0)
+            _written_since_scan[self.chunk_dir] += len(value)
+            self.index[path] = len(value)
+            self.index.move_to_end(path)
+            self._evict()
+
+    def _evict(self):
+        # The tally only sees this process's writes, so the real folder is read again before evicting
+        # and after every rescan_share of the budget written; reads touch mtimes, so the order is shared too
+        if _disk_bytes[self.chunk_dir] > self.max_bytes or _written_since_scan[self.chunk_dir] >= self.max_bytes * rescan_share:
+            _scan_disk(self.chunk_dir)
+        if _disk_bytes[self.chunk_dir] <= self.max_bytes:
+            return
+
+        # Evict down to a little under the budget, so a full cache is not rescanned on every write
+        target_bytes = self.max_bytes * (1 - rescan_share)
+        while _disk_bytes[self.chunk_dir] > target_bytes and self.index:
+            path, size = self.index.popitem(last=False)
+            _disk_bytes[self.chunk_dir] -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __getitem__(self, key):
+        value = self._read_cached(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self.mapper[key]
+        self.bytes_fetched += len(value)
+        self._write_cached(key, value)
+        return value
+
+    def getitems(self, keys, *, contexts=None):
+        # Serve what is on disk and fetch the remaining keys in one batch when the mapper supports it
+        results = {}
+        missing = []
+        for key in keys:
+            value = self._read_cached(key)
+            if value is None:
+                missing.append(key)
+            else:
+                results[key] = value
+        self.hits += len(results)
+        self.misses += len(missing)
+        if missing:
+            if isinstance(self.mapper, FSMap):
+                fetched = self.mapper.getitems(missing, on_error='omit')
+            elif isinstance(self.mapper, BaseStore):
+                fetched = self.mapper.getitems(missing, contexts={})
+            else:
+                fetched = {key: self.mapper[key] for key in missing if key in self.mapper}
+            for key, value in fetched.items():
+                self.bytes_fetched += len(value)
+                self._write_cached(key, value)
+            results.update(fetched)
+        return results
+
+    def __contains__(self, key):
+        return self._path(key) in self.index or key in self.mapper
+
+    def __setitem__(self, key, value):
+        raise PermissionError('ChunkCache is read-only')
+
+    def __delitem__(self, key):
+        raise PermissionError('ChunkCache is read-only')
+
+    def __iter__(self):
+        return iter(self.mapper)
+
+    def __len__(self):
+        return len(self.mapper)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes_fetched': self.bytes_fetched,
+            'bytes_cached': _disk_bytes[self.chunk_dir],
+        }
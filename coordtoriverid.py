@@ -1,13 +1,17 @@
 import os
+import pickle
+import sqlite3
+import numpy as np
 import pandas as pd
 import geoglows
+from scipy.spatial import cKDTree
+from rivid_index import cache_dir
 
 
-os.environ['PYGEOGLOWS_METADATA_TABLE_PATH'] = '/Users/sinugp/.pyenv/versions/3.10.0/lib/python3.10/site-packages/geoglows/data/metadata-tables.parquet'
+os.environ.setdefault('PYGEOGLOWS_METADATA_TABLE_PATH', '/Users/sinugp/.pyenv/versions/3.10.0/lib/python3.10/site-packages/geoglows/data/metadata-tables.parquet')
 
-# Load the CSV file
-file_path = '/Users/sinugp/Downloads/altair_points.csv'  
-df = pd.read_csv(file_path)
+# Mean Earth radius used to turn chord lengths on the unit sphere into kilometres
+earth_radius_km = 6371.0088
 
 # Function to get river number using GeoGLOWS API
 def get_river_number(lat, lon):
@@ -18,12 +22,130 @@ def get_river_number(lat, lon):
         print(f"Error fetching river ID for coordinates ({lat}, {lon}): {e}")
         return None
 
-# Add a new column for river numbers
-df['RiverNumber'] = df.apply(lambda row: get_river_number(row['YCoordinate'], row['XCoordinate']), axis=1)
+# Function to turn lat/lon in degrees into points on the unit sphere
+def to_unit_vectors(lats, lons):
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lats = np.cos(lats)
+    return np.column_stack([cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)])
 
-# Save the updated dataframe to a new CSV file
-output_file_path = '/Users/sinugp/Downloads/altair_points_with_river_numbers.csv'  
-df.to_csv(output_file_path, index=False)
+# Function to get a version tag for the metadata table, so caches built from an older table are not reused
+def get_metadata_version(metadata_path=None):
+    metadata_path = metadata_path or os.environ['PYGEOGLOWS_METADATA_TABLE_PATH']
+    stat = os.stat(metadata_path)
+    return f'{int(stat.st_mtime)}_{stat.st_size}'
 
-# Display the dataframe
-print(df.head())
+# Function to load the river KD-tree, building it from the metadata table and saving it on first use
+def load_river_tree(metadata_path=None):
+    metadata_path = metadata_path or os.environ['PYGEOGLOWS_METADATA_TABLE_PATH']
+    tree_path = os.path.join(cache_dir, f'river_tree_{get_metadata_version(metadata_path)}.pkl')
+    if os.path.exists(tree_path):
+        with open(tree_path, 'rb') as f:
+            return pickle.load(f)
+
+    metadata = pd.read_parquet(metadata_path, columns=['LINKNO', 'lat', 'lon'])
+    tree = cKDTree(to_unit_vectors(metadata['lat'].values, metadata['lon'].values))
+    river_tree = (tree, metadata['LINKNO'].values)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{tree_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(river_tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, tree_path)
+    return river_tree
+
+# Function to resolve whole columns of coordinates to river IDs and snap distances in km
+def coords_to_river_ids(lats, lons, river_tree=None):
+    tree, river_ids = river_tree or load_river_tree()
+    points = to_unit_vectors(lats, lons)
+
+    # Rows with missing coordinates get no river and a NaN distance
+    valid = np.isfinite(points).all(axis=1)
+    chord, positions = tree.query(points[valid], workers=-1)
+    matched_ids = pd.array(np.zeros(len(points), dtype=np.int64), dtype='Int64')
+    matched_ids[~valid] = pd.NA
+    matched_ids[valid] = river_ids[positions]
+    distances_km = np.full(len(points), np.nan)
+    distances_km[valid] = 2 * earth_radius_km * np.arcsin(np.clip(chord / 2, 0, 1))
+    return matched_ids, distances_km
+
+# Function to turn coordinates into integer cache keys: rounded to precision decimals, or the exact float bits when precision is None
+def get_coordinate_keys(values, precision):
+    values = np.asarray(values, dtype=np.float64) + 0.0  # -0.0 and 0.0 share a key
+    missing = ~np.isfinite(values)
+    values = np.where(missing, 0.0, values)
+    keys = values.view(np.int64) if precision is None else np.round(values * 10 ** precision).astype(np.int64)
+    keys = pd.array(keys, dtype='Int64')
+    keys[missing] = pd.NA
+    return keys
+
+# Function to turn cache keys back into the coordinates they stand for
+def get_key_coordinates(keys, precision):
+    keys = np.asarray(keys, dtype=np.int64)
+    return keys.view(np.float64) if precision is None else keys / 10 ** precision
+
+# Function to resolve coordinates through the on-disk geocoding cache, looking up only coordinates not seen before.
+# Points are snapped from their rounded coordinate, so the distance can be off by the rounding (under 0.1 m at the
+# default 6 decimals); precision=None keys on the exact floats and gives exact distances
+def geocode_points(lats, lons, precision=6, cache_path=None, metadata_path=None):
+    cache_path = cache_path or os.path.join(cache_dir, 'geocode_cache.sqlite')
+    version = get_metadata_version(metadata_path)
+    precision_key = -1 if precision is None else precision
+
+    # Key every coordinate at the requested precision and keep each distinct coordinate once
+    points = pd.DataFrame({
+        'lat_key': get_coordinate_keys(lats, precision),
+        'lon_key': get_coordinate_keys(lons, precision),
+    })
+    valid = points.notna().all(axis=1).values
+    keys = points[valid].astype(np.int64).drop_duplicates(ignore_index=True)
+
+    # Pull whatever is already cached for these coordinates
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with sqlite3.connect(cache_path) as conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocode (version TEXT, precision INTEGER, lat_key INTEGER, lon_key INTEGER, '
+            'river_id INTEGER, distance_km REAL, PRIMARY KEY (version, precision, lat_key, lon_key))'
+        )
+        conn.execute('CREATE TEMP TABLE wanted (lat_key INTEGER, lon_key INTEGER, PRIMARY KEY (lat_key, lon_key))')
+        conn.executemany('INSERT INTO wanted VALUES (?, ?)', keys.itertuples(index=False, name=None))
+        cached = pd.read_sql_query(
+            'SELECT g.lat_key, g.lon_key, g.river_id, g.distance_km FROM wanted w JOIN geocode g '
+            'ON g.lat_key = w.lat_key AND g.lon_key = w.lon_key WHERE g.version = ? AND g.precision = ?',
+            conn, params=(version, precision_key),
+        )
+
+        # Resolve the new coordinates in one vectorized query and add them to the cache
+        new_keys = keys.merge(cached[['lat_key', 'lon_key']], how='left', indicator=True)
+        new_keys = new_keys[new_keys['_merge'] == 'left_only'].drop(columns='_merge')
+        if not new_keys.empty:
+            river_ids, distances_km = coords_to_river_ids(
+                get_key_coordinates(new_keys['lat_key'], precision), get_key_coordinates(new_keys['lon_key'], precision),
+                load_river_tree(metadata_path)
+            )
+            new_keys = new_keys.assign(river_id=river_ids, distance_km=distances_km)
+            conn.executemany(
+                'INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)',
+                [(version, precision_key, int(lat_key), int(lon_key), int(river_id), float(distance_km))
+                 for lat_key, lon_key, river_id, distance_km in new_keys.itertuples(index=False, name=None)],
+            )
+            cached = pd.concat([cached, new_keys], ignore_index=True) if not cached.empty else new_keys
+
+    # Map the results back onto every input row
+    resolved = points.merge(cached.astype({'lat_key': 'Int64', 'lon_key': 'Int64'}), how='left', on=['lat_key', 'lon_key'])
+    return resolved['river_id'].astype('Int64').values, resolved['distance_km'].astype('float64').values
+
+if __name__ == '__main__':
+    # Load the CSV file
+    file_path = '/Users/sinugp/Downloads/altair_points.csv'
+    df = pd.read_csv(file_path)
+
+    # Add new columns for river numbers and the distance to the matched river
+    df['RiverNumber'], df['SnapDistanceKm'] = geocode_points(df['YCoordinate'], df['XCoordinate'])
+
+    # Save the updated dataframe to a new CSV file
+    output_file_path = '/Users/sinugp/Downloads/altair_points_with_river_numbers.csv'
+    df.to_csv(output_file_path, index=False)
+
+    # Display the dataframe
+    print(df.head())
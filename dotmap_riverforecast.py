@@ -1,23 +1,28 @@
-import pandas as pd
+import os
+import json
+import argparse
+import numpy as np
 import plotly.graph_objs as go
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
-import ast
+from longtable_loader import get_dataset_version
+from render_cache import render_cache
+from river_forecasts import load_river_forecasts
 
-# Load the CSV file
+# Load the CSV file; ForecastData is parsed once into a float32 sidecar matrix (row i holds river i's forecast).
+# The matrix is memory-mapped read-only, so every worker process shares one copy through the page cache
 file_path = '/Users/sinugp/Downloads/merged_river_data.csv'
-df = pd.read_csv(file_path)
-
-# Convert ForecastData from string representation of lists to actual lists
-df['ForecastData'] = df['ForecastData'].apply(ast.literal_eval)
+df, forecasts, forecast_lengths = load_river_forecasts(file_path, mmap_mode='r')
+dataset_version = get_dataset_version(file_path)
 
 # Determine the bounds of the map based on the river points
 min_lat, max_lat = df['XCoordinate'].min(), df['XCoordinate'].max()
 min_lon, max_lon = df['YCoordinate'].min(), df['YCoordinate'].max()
 
-# Initialize the Dash app
+# Initialize the Dash app; server is the WSGI entry point for multi-worker serving
 app = dash.Dash(__name__)
+server = app.server
 
 # Layout of the app
 app.layout = html.Div([
@@ -30,7 +35,8 @@ app.layout = html.Div([
                     lat=df['XCoordinate'],
                     mode='markers',
                     marker=dict(size=10),
-                    text=[f'River {num}' for num in df['RiverNumber']],
+                    text='River ' + df['RiverNumber'].astype(str),
+                    customdata=np.arange(len(df)),  # Row of each marker, so a click needs no search
                     hoverinfo='text',
                     name='Rivers'
                 )
@@ -59,19 +65,35 @@ def display_forecast_data(clickData):
     if clickData is None:
         return go.Figure()  # Return an empty figure if no point is clicked
 
-    # Extract latitude and longitude from the clickData
-    lon = clickData['points'][0]['lon']
-    lat = clickData['points'][0]['lat']
-    
-    # Find the corresponding RiverNumber
-    river_number = df[(df['YCoordinate'] == lon) & (df['XCoordinate'] == lat)]['RiverNumber'].values[0]
-    forecast_data = df.loc[df['RiverNumber'] == river_number, 'ForecastData'].values[0]
+    # The clicked marker carries its row in customdata
+    row = int(clickData['points'][0]['customdata'])
+
+    # Figures are kept as JSON in a size-bounded LRU, so repeat clicks on a river skip building the figure
+    figure_json = render_cache.remember((dataset_version, 'forecast_figure', row), lambda: build_forecast_figure(row).to_json().encode())
+    return json.loads(figure_json)
+
+# Function to build the forecast figure of one river row
+def build_forecast_figure(row):
+    river_number = df['RiverNumber'].iat[row]
+    forecast_data = forecasts[row, :forecast_lengths[row]]
 
     return go.Figure(
         data=[go.Scatter(x=list(range(len(forecast_data))), y=forecast_data, mode='lines+markers')],
         layout=go.Layout(title=f'Forecast Data for River {river_number}', xaxis_title='Time', yaxis_title='Flow')
     )
 
-# Run the app with custom host and port
+# Run the app with custom host and port; with --workers N it is served by N gunicorn worker processes
+# (equivalent to: gunicorn --preload -w N -b localhost:8051 dotmap_riverforecast:server)
 if __name__ == '__main__':
-    app.run_server(debug=True, host='localhost', port=8051)
+    parser = argparse.ArgumentParser(description='Serve the river forecast dot map')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes; more than 1 serves through gunicorn')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8051)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # --preload builds the sidecar once in the parent before the workers fork
+        os.execvp('gunicorn', ['gunicorn', '--preload', '-w', str(args.workers), '-b', f'{args.host}:{args.port}',
+                               '--chdir', os.path.dirname(os.path.abspath(__file__)), 'dotmap_riverforecast:server'])
+    else:
+        app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Points kept per horizontal pixel of the chart; more cannot be told apart on screen
+points_per_pixel = 2
+
+# Function to turn a column into floats for the triangle areas, with dates as nanoseconds
+def _as_float(values):
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    return values.to_numpy(dtype=np.float64)
+
+# Function to pick the row positions to keep: Largest-Triangle-Three-Buckets plus the min and max of every bucket
+def lttb_minmax_indices(x, y, n_out):
+    x = _as_float(x)
+    y = _as_float(y)
+    n = len(y)
+    if n_out >= n or n < 3:
+        return np.arange(n)
+
+    # Up to three points per bucket (LTTB pick, min, max) plus the two end points
+    n_buckets = max((n_out - 2) // 3, 1)
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(np.int64)
+    selected = [0, n - 1]
+    previous = 0
+    for i in range(n_buckets):
+        start, stop = edges[i], edges[i + 1]
+        if stop <= start:
+            continue
+        if i + 1 < n_buckets and edges[i + 2] > stop:
+            next_x = x[stop:edges[i + 2]].mean()
+            next_y = y[stop:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+
+        # Keep the point forming the largest triangle with the previous pick and the next bucket's mean
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous]) - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.nanargmax(area)) if not np.isnan(area).all() else start
+        selected.append(previous)
+
+        # Peaks and troughs survive even when LTTB picked a different point
+        bucket = y[start:stop]
+        if not np.isnan(bucket).all():
+            selected.append(start + int(np.nanargmin(bucket)))
+            selected.append(start + int(np.nanargmax(bucket)))
+    return np.unique(selected)
+
+# Function to downsample a frame along x to what a chart of the given pixel width can show
+def downsample_frame(df, x_column, y_column, width_px=800):
+    n_out = int(width_px * points_per_pixel)
+    if len(df) <= n_out:
+        return df
+    if not df[x_column].is_monotonic_increasing:
+        df = df.sort_values(x_column, kind='stable')
+    return df.iloc[lttb_minmax_indices(df[x_column], df[y_column], n_out)]
+
+# Function to get a matplotlib figure's width in pixels
+def get_figure_width(fig):
+    return int(fig.get_figwidth() * fig.dpi)
@@ -0,0 +1,41 @@
+import warnings
+import numpy as np
+
+# Per-timestep summary columns stored next to the raw ensemble members
+stat_percentiles = {'stat_p10': 10, 'stat_p25': 25, 'stat_median': 50, 'stat_p75': 75, 'stat_p90': 90}
+stat_columns = ['stat_mean', 'stat_min'] + list(stat_percentiles) + ['stat_max']
+
+# Function to take linear percentiles over an axis while ignoring NaN, without np.nanpercentile's per-cell Python loop
+def nan_percentiles(values, percentiles, axis=0):
+    values = np.asarray(values)
+    if not np.isnan(values).any():
+        return np.percentile(values, percentiles, axis=axis)
+
+    # Sorting puts the NaN members last, so each cell's valid members are its first `count` entries
+    sorted_values = np.sort(np.moveaxis(values, axis, 0), axis=0)
+    count = (~np.isnan(sorted_values)).sum(axis=0)
+    results = []
+    for percentile in percentiles:
+        position = (count - 1) * (percentile / 100.0)
+        lower = np.clip(np.floor(position).astype(np.int64), 0, None)
+        upper = np.clip(np.minimum(lower + 1, count - 1), 0, None)
+        lower_values = np.take_along_axis(sorted_values, lower[None], axis=0)[0]
+        upper_values = np.take_along_axis(sorted_values, upper[None], axis=0)[0]
+        result = lower_values + (upper_values - lower_values) * (position - lower)
+        results.append(np.where(count > 0, result, np.nan))
+    return np.stack(results)
+
+# Function to summarise an ensemble array over its ensemble axis, ignoring missing members
+def compute_ensemble_stats(qout_array, axis=0):
+    qout_array = np.asarray(qout_array, dtype=np.float32)
+    with warnings.catch_warnings():
+        # Timesteps where every member is NaN just give NaN statistics
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        percentiles = nan_percentiles(qout_array, list(stat_percentiles.values()), axis=axis)
+        stats = {
+            'stat_mean': np.nanmean(qout_array, axis=axis),
+            'stat_min': np.nanmin(qout_array, axis=axis),
+            'stat_max': np.nanmax(qout_array, axis=axis),
+        }
+    stats.update(zip(stat_percentiles, percentiles))
+    return {name: stats[name].astype(np.float32) for name in stat_columns}
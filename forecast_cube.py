@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from forecast_io import get_ensemble_columns
+
+# Index sidecar inside a cube folder, naming the raw float32 data file it describes
+index_file = 'index.json'
+
+_open_cubes = {}
+
+
+class ForecastCubeWriter:
+    # Appends batches of forecast frames to a river-major float32 cube on disk
+
+    def __init__(self, cube_path):
+        self.cube_path = cube_path
+        os.makedirs(cube_path, exist_ok=True)
+        self.data_file = f'cube-{os.getpid()}-{time.time_ns()}.f32'
+        self.data = open(os.path.join(cube_path, self.data_file), 'wb')
+        self.river_numbers = []
+        self.times = None
+        self.ensembles = None
+
+    def append(self, forecast_df):
+        # Frames come in the get_forecast_data_many layout: a row per (river, time), river-major
+        ensemble_columns = get_ensemble_columns(forecast_df)
+        river_numbers = pd.unique(forecast_df['RiverNumber'])
+        n_times = len(forecast_df) // len(river_numbers)
+        if self.times is None:
+            self.times = pd.to_datetime(forecast_df.index[:n_times]).values.astype('datetime64[ns]')
+            self.ensembles = ensemble_columns
+        elif n_times != len(self.times) or ensemble_columns != self.ensembles:
+            raise ValueError('All batches written to one cube must share the same time and ensemble axes')
+        self.data.write(np.ascontiguousarray(forecast_df[ensemble_columns].to_numpy(dtype=np.float32)).tobytes())
+        self.river_numbers.extend(int(river_number) for river_number in river_numbers)
+
+    def close(self):
+        # The index is swapped in last, so readers only ever see a finished data file
+        self.data.close()
+        index = {
+            'data_file': self.data_file,
+            'river_numbers': self.river_numbers,
+            'times': [] if self.times is None else self.times.astype(np.int64).tolist(),
+            'ensembles': self.ensembles or [],
+        }
+        tmp_index_path = os.path.join(self.cube_path, f'{index_file}.{os.getpid()}.tmp')
+        with open(tmp_index_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_index_path, os.path.join(self.cube_path, index_file))
+
+        # Older data files can go; processes still mapping them keep their copy until they reopen
+        for name in os.listdir(self.cube_path):
+            if name.startswith('cube-') and name.endswith('.f32') and name != self.data_file:
+                os.remove(os.path.join(self.cube_path, name))
+
+
+class ForecastCube:
+    # Read-only memory-mapped view of a cube; slices are zero-copy views into the page cache
+
+    def __init__(self, cube_path):
+        with open(os.path.join(cube_path, index_file)) as f:
+            index = json.load(f)
+        self.river_numbers = np.asarray(index['river_numbers'], dtype=np.int64)
+        self.times = np.asarray(index['times'], dtype=np.int64).astype('datetime64[ns]')
+        self.ensembles = index['ensembles']
+        shape = (len(self.river_numbers), len(self.times), len(self.ensembles))
+        if 0 in shape:
+            self.values = np.empty(shape, dtype=np.float32)
+        else:
+            self.values = np.memmap(os.path.join(cube_path, index['data_file']), dtype=np.float32, mode='r', shape=shape)
+        self.order = np.argsort(self.river_numbers, kind='stable')
+        self.sorted_river_numbers = self.river_numbers[self.order]
+
+    def river_position(self, river_number):
+        position = np.searchsorted(self.sorted_river_numbers, river_number)
+        if position < len(self.sorted_river_numbers) and self.sorted_river_numbers[position] == river_number:
+            return self.order[position]
+        raise KeyError(river_number)
+
+    def river(self, river_number):
+        # A time x ensemble view of one river
+        return self.values[self.river_position(river_number)]
+
+    def river_frame(self, river_number):
+        return pd.DataFrame(self.river(river_number), index=self.times, columns=self.ensembles, copy=False)
+
+# Function to open a cube once per process and reuse the same mapping afterwards
+def open_forecast_cube(cube_path):
+    cube_path = os.path.abspath(cube_path)
+    index_mtime = os.path.getmtime(os.path.join(cube_path, index_file))
+    cached = _open_cubes.get(cube_path)
+    if cached is None or cached[0] != index_mtime:
+        cached = (index_mtime, ForecastCube(cube_path))
+        _open_cubes[cube_path] = cached
+    return cached[1]
@@ -1,7 +1,5 @@
-import zarr
-import s3fs
 import pandas as pd
-import boto3
+from store_pool import get_filesystem, open_zarr_group
 
 # Define the S3 bucket and Zarr path
 bucket_name = 'my-river-flow-bucket'
@@ -11,25 +9,23 @@ zarr_path = 'sample.zarr/'  # Path to the Zarr directory in S3
 csv_file_path = '/Users/sinugp/Downloads/altair_points_with_river_numbers.csv'
 output_csv_file_path = '/Users/sinugp/Downloads/river_flow_forecast_data.csv'
 
-# Initialize S3 client and list objects in the bucket to verify
-s3 = boto3.client('s3')
-response = s3.list_objects_v2(Bucket=bucket_name, Prefix=zarr_path)
-if 'Contents' in response:
+# Get the pooled S3 filesystem and list objects in the bucket to verify
+s3 = get_filesystem(f's3://{bucket_name}/', anon=False)
+keys = s3.find(f'{bucket_name}/{zarr_path}')
+if keys:
     print("Objects in the bucket:")
-    for obj in response['Contents']:
-        print(obj['Key'])
+    for key in keys:
+        print(key.split('/', 1)[1])
 else:
     print("No objects found in the bucket with the given prefix.")
 
 # Access the Zarr group using s3fs and zarr
 try:
-    # Use fsspec to map the S3 URL
+    # Define the S3 URL of the Zarr group
     url = f's3://my-river-flow-bucket/sample.zarr/'
     print(f"Attempting to access Zarr group at: {url}")
-    mapper = s3fs.S3Map(root=url, s3=s3fs.S3FileSystem(), check=False)
-    
-    # Open the Zarr group
-    zarr_group = zarr.open_group(mapper, mode='r')
+    # Open the Zarr group through the shared pool, reusing the filesystem above
+    zarr_group = open_zarr_group(url, anon=False)
     print("Zarr group opened successfully")
     print(zarr_group.tree())
 except Exception as e:
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from ensemble_stats import stat_columns
+
+# Partition layout of the forecast dataset: one folder per forecast date, one per river below it
+partitioning = ds.partitioning(pa.schema([('Date', pa.string()), ('RiverNumber', pa.int64())]), flavor='hive')
+
+# Pandas units for the CF-style time units used in the forecast stores
+time_units = {'seconds': 's', 'minutes': 'min', 'hours': 'h', 'days': 'D'}
+
+# Function to read the time axis, decoding "<units> since <origin>" offsets into timestamps
+def read_time_array(zarr_group):
+    time = zarr_group['time']
+    time_array = time[:]
+    units = time.attrs.get('units', '')
+    if ' since ' in units and np.issubdtype(time_array.dtype, np.number):
+        unit, origin = units.split(' since ', 1)
+        return (pd.Timestamp(origin) + pd.to_timedelta(time_array, unit=time_units[unit.strip()])).values
+    return time_array
+
+# Function to get the ensemble member columns of a forecast frame
+def get_ensemble_columns(forecast_df):
+    return [col for col in forecast_df.columns if str(col).startswith('ensemble_')]
+
+# Function to turn a forecast frame into an Arrow table with float32 flows and a typed time column
+def to_forecast_table(forecast_df):
+    flow_columns = get_ensemble_columns(forecast_df) + [col for col in stat_columns if col in forecast_df.columns]
+    table_df = forecast_df.rename_axis('time').reset_index()
+    table_df['time'] = pd.to_datetime(table_df['time'])
+    table_df[flow_columns] = table_df[flow_columns].astype(np.float32)
+    table_df['RiverNumber'] = table_df['RiverNumber'].astype(np.int64)
+    table_df['Date'] = table_df['Date'].astype(str)
+    return pa.Table.from_pandas(table_df[['time'] + flow_columns + ['RiverNumber', 'Date']], preserve_index=False)
+
+# Function to write forecast data to a Parquet dataset partitioned by Date and RiverNumber
+def write_forecast_dataset(forecast_df, dataset_path):
+    # Rewriting a (Date, RiverNumber) partition replaces its file, so reruns do not duplicate rows
+    ds.write_dataset(
+        to_forecast_table(forecast_df),
+        dataset_path,
+        format='parquet',
+        partitioning=partitioning,
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+# Function to export forecast data to CSV in the original flat layout
+def write_forecast_csv(forecast_df, csv_path, append=False):
+    forecast_df.to_csv(csv_path, index=False, mode='a' if append else 'w',
+                       header=not (append and os.path.exists(csv_path)))
+
+# Function to list the forecast dates stored in a dataset from its partition folders, oldest first, without reading any rows
+def list_forecast_dates(dataset_path):
+    dataset = ds.dataset(dataset_path, format='parquet', partitioning=partitioning)
+    dates = {ds.get_partition_keys(fragment.partition_expression).get('Date') for fragment in dataset.get_fragments()}
+    return sorted(date for date in dates if date is not None)
+
+# Function to read forecast data, loading only the partitions and columns asked for
+def read_forecast_dataset(dataset_path, river_numbers=None, dates=None, columns=None):
+    dataset = ds.dataset(dataset_path, format='parquet', partitioning=partitioning)
+
+    # Filters on partition keys prune whole folders before any file is opened
+    filters = []
+    if river_numbers is not None:
+        filters.append(ds.field('RiverNumber').isin([int(r) for r in river_numbers]))
+    if dates is not None:
+        filters.append(ds.field('Date').isin([str(d) for d in dates]))
+    filter_expression = None
+    for expression in filters:
+        filter_expression = expression if filter_expression is None else filter_expression & expression
+
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ['RiverNumber', 'Date']))
+    forecast_df = dataset.to_table(columns=columns, filter=filter_expression).to_pandas()
+
+    # Parse each distinct forecast date once rather than every row
+    dates = forecast_df['Date'].astype('category')
+    forecast_df['Date'] = dates.cat.rename_categories(pd.to_datetime(dates.cat.categories, format='%Y%m%d%H')).astype('datetime64[ns]')
+    return forecast_df
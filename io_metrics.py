@@ -0,0 +1,139 @@
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from zarr.storage import BaseStore
+from fsspec.mapping import FSMap
+
+# Keys holding Zarr metadata rather than chunk data
+metadata_suffixes = ('.zmetadata', '.zarray', '.zattrs', '.zgroup')
+
+_phases = defaultdict(lambda: {'calls': 0, 'seconds': 0.0})
+_requests = defaultdict(lambda: {'requests': 0, 'bytes': 0, 'seconds': 0.0, 'missing': 0})
+_lock = threading.Lock()
+
+# Function to make a hashable, sorted label key
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+# Context manager to add the wall time of a block to a phase, e.g. timed('qout_read', date=date)
+@contextmanager
+def timed(phase, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            entry = _phases[(phase, _labels_key(labels))]
+            entry['calls'] += 1
+            entry['seconds'] += elapsed
+
+# Function to count store requests by store and key kind
+def record_requests(store, kind, requests, n_bytes, seconds, missing=0):
+    with _lock:
+        entry = _requests[(store, kind)]
+        entry['requests'] += requests
+        entry['bytes'] += n_bytes
+        entry['seconds'] += seconds
+        entry['missing'] += missing
+
+# Function to clear every counter, e.g. between runs in one process
+def reset_metrics():
+    with _lock:
+        _phases.clear()
+        _requests.clear()
+
+
+class InstrumentedMapper(BaseStore):
+    # Read-only store that counts the requests, bytes and latency of the mapper it wraps
+
+    def __init__(self, mapper, store_path=None):
+        self.mapper = mapper
+        self.store_path = store_path or getattr(mapper, 'root', str(id(mapper)))
+
+    @staticmethod
+    def _kind(key):
+        return 'metadata' if key.endswith(metadata_suffixes) else 'chunk'
+
+    def __getitem__(self, key):
+        start = time.perf_counter()
+        try:
+            value = self.mapper[key]
+        except KeyError:
+            record_requests(self.store_path, self._kind(key), 1, 0, time.perf_counter() - start, missing=1)
+            raise
+        record_requests(self.store_path, self._kind(key), 1, len(value), time.perf_counter() - start)
+        return value
+
+    def getitems(self, keys, *, contexts=None):
+        # Batched fetches keep their concurrency; the batch latency is shared across its keys
+        keys = list(keys)
+        start = time.perf_counter()
+        if isinstance(self.mapper, FSMap):
+            values = self.mapper.getitems(keys, on_error='omit')
+        else:
+            values = {key: self.mapper[key] for key in keys if key in self.mapper}
+        elapsed = time.perf_counter() - start
+        by_kind = defaultdict(list)
+        for key in keys:
+            by_kind[self._kind(key)].append(key)
+        for kind, kind_keys in by_kind.items():
+            n_bytes = sum(len(values[key]) for key in kind_keys if key in values)
+            missing = sum(1 for key in kind_keys if key not in values)
+            record_requests(self.store_path, kind, len(kind_keys), n_bytes, elapsed * len(kind_keys) / len(keys), missing)
+        return values
+
+    def __contains__(self, key):
+        return key in self.mapper
+
+    def __setitem__(self, key, value):
+        raise PermissionError('InstrumentedMapper is read-only')
+
+    def __delitem__(self, key):
+        raise PermissionError('InstrumentedMapper is read-only')
+
+    def __iter__(self):
+        return iter(self.mapper)
+
+    def __len__(self):
+        return len(self.mapper)
+
+# Function to collect all counters into a JSON-ready report
+def get_report():
+    with _lock:
+        phases = [{'phase': phase, **dict(labels), **values} for (phase, labels), values in _phases.items()]
+        requests = [{'store': store, 'kind': kind, **values} for (store, kind), values in _requests.items()]
+    return {'generated_at': time.time(), 'phases': phases, 'requests': requests}
+
+# Function to write the report as JSON
+def export_json(path):
+    with open(path, 'w') as f:
+        json.dump(get_report(), f, indent=1)
+
+# Function to escape a Prometheus label value
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Function to write the counters in the Prometheus text exposition format
+def export_prometheus(path, prefix='river_id'):
+    report = get_report()
+    metrics = [
+        (f'{prefix}_phase_calls_total', 'Calls per ingest phase', 'phases', 'calls'),
+        (f'{prefix}_phase_seconds_total', 'Wall time per ingest phase', 'phases', 'seconds'),
+        (f'{prefix}_store_requests_total', 'Store requests by key kind', 'requests', 'requests'),
+        (f'{prefix}_store_bytes_total', 'Bytes read from the store by key kind', 'requests', 'bytes'),
+        (f'{prefix}_store_request_seconds_total', 'Store request latency by key kind', 'requests', 'seconds'),
+        (f'{prefix}_store_missing_total', 'Requested keys missing from the store', 'requests', 'missing'),
+    ]
+    lines = []
+    for name, help_text, section, field in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for row in report[section]:
+            labels = ','.join(f'{key}="{_escape(value)}"' for key, value in row.items()
+                              if key not in ('calls', 'seconds', 'requests', 'bytes', 'missing'))
+            lines.append(f'{name}{{{labels}}} {row[field]}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from rivid_index import cache_dir
+
+# Prefix of the warning level columns that repeat the same value on every row of an Id
+warning_level_prefix = 'ActiveThemeWarningLevelValues_'
+
+# Columns stored as categoricals when present
+categorical_columns = ['Id', 'Name', 'state']
+
+# Function to get a version string for a data file that changes whenever the file is rewritten
+def get_dataset_version(path):
+    stat = os.stat(path)
+    return hashlib.sha1(f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()
+
+# Function to get the cache file paths for a CSV, tied to its size and modification time
+def _cache_paths(csv_path):
+    key = get_dataset_version(csv_path)
+    folder = os.path.join(cache_dir, 'longtables')
+    return os.path.join(folder, f'{key}.feather'), os.path.join(folder, f'{key}.levels.json')
+
+# Function to give the long table compact dtypes and split off the per-Id warning levels
+def type_long_table(data):
+    data = data.copy()
+    if 'date' in data.columns:
+        data['date'] = pd.to_datetime(data['date'])
+    for column in categorical_columns:
+        if column in data.columns:
+            data[column] = data[column].astype('category')
+    if 'value' in data.columns:
+        data['value'] = data['value'].astype('float32')
+    if 'ens_mem' in data.columns:
+        data['ens_mem'] = pd.to_numeric(data['ens_mem'], downcast='integer')
+
+    # Warning levels are constant per Id, so keep one row per Id instead of one per reading
+    level_columns = [column for column in data.columns if column.startswith(warning_level_prefix)]
+    warning_levels = data.groupby('Id', observed=True, sort=False)[level_columns].first() if level_columns else pd.DataFrame()
+    return data.drop(columns=level_columns), warning_levels
+
+# Function to load a long-format forecast CSV once, reusing the typed Feather copy while the CSV is unchanged
+def load_long_table(csv_path, use_cache=True):
+    if use_cache:
+        table_path, levels_path = _cache_paths(csv_path)
+        if os.path.exists(table_path) and os.path.exists(levels_path):
+            data = pd.read_feather(table_path)
+            with open(levels_path) as f:
+                levels = json.load(f)
+            warning_levels = pd.DataFrame(levels['values'], index=pd.Index(levels['ids'], name='Id'), columns=levels['columns'])
+            return data, warning_levels
+
+    data, warning_levels = type_long_table(pd.read_csv(csv_path))
+
+    if use_cache:
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+        tmp_path = f'{table_path}.{os.getpid()}.tmp'
+        data.to_feather(tmp_path)
+        os.replace(tmp_path, table_path)
+        levels = {
+            'ids': warning_levels.index.tolist(),
+            'columns': warning_levels.columns.tolist(),
+            'values': warning_levels.values.tolist(),
+        }
+        with open(levels_path, 'w') as f:
+            json.dump(levels, f)
+    return data, warning_levels
+
+
+class GroupIndex:
+    # Row positions, names and states per key, built once so per-Id lookups skip full-table scans
+
+    def __init__(self, data, key_column='Id', name_column='Name', state_column=None):
+        self.data = data
+        self.positions = data.groupby(key_column, observed=True, sort=False).indices
+
+        columns = [key_column] + [column for column in (name_column, state_column) if column]
+        first_rows = data[columns].drop_duplicates(subset=[key_column])
+        self.first_names = dict(zip(first_rows[key_column], first_rows[name_column])) if name_column else {}
+        self.first_states = dict(zip(first_rows[key_column], first_rows[state_column])) if state_column else {}
+
+        self.names = {}
+        self.state_names = {}
+        if name_column:
+            pairs = data[columns].drop_duplicates()
+            for key, name in zip(pairs[key_column], pairs[name_column]):
+                self.names.setdefault(key, [])
+                if name not in self.names[key]:
+                    self.names[key].append(name)
+            if state_column:
+                for key, state, name in zip(pairs[key_column], pairs[state_column], pairs[name_column]):
+                    self.state_names.setdefault((key, state), []).append(name)
+
+    def rows(self, key):
+        # Rows of one key in their original order, or an empty frame for an unknown key
+        return self.data.iloc[self.positions.get(key, [])]
+
+    def get_names(self, key, state=None):
+        if state is None:
+            return list(self.names.get(key, []))
+        return list(self.state_names.get((key, state), []))
+
+    def first_name(self, key, default=""):
+        return self.first_names.get(key, default)
+
+    def first_state(self, key, default=""):
+        return self.first_states.get(key, default)
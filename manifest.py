@@ -0,0 +1,49 @@
+import os
+import json
+import hashlib
+import numpy as np
+from forecast_io import get_ensemble_columns
+from store_pool import get_filesystem, get_forecast_url, read_store_version
+
+# Function to load the manifest of processed forecasts, empty when none was written yet
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {'dates': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+# Function to save the manifest atomically, so an interrupted run never leaves it half written
+def save_manifest(manifest, manifest_path):
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+# Function to fingerprint a published forecast store from its metadata file and its last write, read straight from the bucket
+def get_store_fingerprint(date, bucket_url=None):
+    url = get_forecast_url(date, bucket_url)
+    fs = get_filesystem(url)
+    for key in ('.zmetadata', 'Qout/.zarray'):
+        try:
+            path = f'{url}/{key}'
+            info = fs.info(path)
+            version = info.get('ETag') or info.get('LastModified') or info.get('mtime')
+            return hashlib.sha1(fs.cat(path) + str(version).encode()).hexdigest()
+        except FileNotFoundError:
+            continue
+    return None
+
+# Function to get the version of a published store's metadata file from a single metadata request, without reading it
+def get_store_version(date, bucket_url=None):
+    return read_store_version(get_forecast_url(date, bucket_url))
+
+# Function to checksum the content of each river in a forecast frame
+def get_river_checksums(forecast_df):
+    ensemble_columns = get_ensemble_columns(forecast_df)
+    checksums = {}
+    for river_number, river_df in forecast_df.groupby('RiverNumber', sort=False):
+        values = np.ascontiguousarray(river_df[ensemble_columns].to_numpy(dtype=np.float32))
+        times = np.ascontiguousarray(river_df.index.to_numpy().astype('datetime64[ns]').astype(np.int64))
+        checksums[str(int(river_number))] = hashlib.sha1(values.tobytes() + times.tobytes()).hexdigest()
+    return checksums
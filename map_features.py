@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# Marker colours for value < 10, 10-20, 20-30 and >= 30, matching the map legends
+value_colors = ['green', 'blue', 'orange', 'red']
+
+# Function to pick the marker colour of every value at once
+def get_value_colors(values):
+    values = np.asarray(values)
+    return np.select([values < 10, values < 20, values < 30], value_colors[:3], value_colors[3])
+
+# Function to pick the marker radius of every value at once
+def get_value_radii(values):
+    return np.where(np.asarray(values) < 10, 8, 10)
+
+# Function to escape a string column for use inside a JSON string literal
+def _escape_json(strings):
+    return strings.str.replace('\\', '\\\\', regex=False).str.replace('"', '\\"', regex=False)
+
+
+class TimestampedFeatures:
+    # GeoJSON point features of a long table for TimestampedGeoJson, serialized once; every marker carries a class
+    # name for its ID, so a highlight is a CSS rule added to an already rendered map
+
+    def __init__(self, df, id_index=None):
+        values = df['value'].to_numpy()
+        colors = pd.Series(get_value_colors(values), index=df.index)
+        radii = pd.Series(get_value_radii(values), index=df.index).astype(str)
+        x = df['XCoordinate'].astype(str)
+        y = df['YCoordinate'].astype(str)
+        if pd.api.types.is_datetime64_any_dtype(df['date']):
+            times = df['date'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        else:
+            times = df['date'].astype(str)
+        popups = _escape_json('ID: ' + df['Id'].astype(str) + ' - ' + df['Name'].astype(str) + ': (' + x + ', ' + y + ') Value: '
+                              + df['value'].astype(str))
+
+        # IDs can hold any characters, so their class names are numbered in order of appearance
+        self.positions = id_index.positions if id_index is not None else df.groupby('Id', observed=True, sort=False).indices
+        self.class_names = {key: f'river-id-{number}' for number, key in enumerate(self.positions)}
+        classes = np.empty(len(df), dtype=object)
+        for key, positions in self.positions.items():
+            classes[positions] = self.class_names[key]
+
+        self.features = ('{"type": "Feature", "geometry": {"type": "Point", "coordinates": [' + x + ', ' + y + ']}, '
+                         '"properties": {"time": "' + times + '", "popup": "' + popups + '", "icon": "circle", '
+                         '"iconstyle": {"color": "' + colors + '", "fillColor": "' + colors + '", "fillOpacity": 0.6, '
+                         '"radius": ' + radii + ', "className": "').to_numpy(dtype=object) + classes + '"}}}'
+        self.center = [df['YCoordinate'].mean(), df['XCoordinate'].mean()]
+
+    def to_json(self):
+        return '{"type": "FeatureCollection", "features": [' + ', '.join(self.features) + ']}'
+
+    def highlight_css(self, highlight_id, rule='animation: blinker 1s linear infinite;'):
+        # CSS that applies the rule to the markers of one ID, empty when the ID has no markers
+        if highlight_id is None or highlight_id not in self.class_names:
+            return ''
+        return f'.{self.class_names[highlight_id]} {{ {rule} }}'
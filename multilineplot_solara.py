@@ -1,17 +1,29 @@
-import pandas as pd
+import io
+import html
 import solara
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import folium
 from folium.plugins import TimestampedGeoJson
+from downsample import downsample_frame, get_figure_width
+from longtable_loader import GroupIndex, get_dataset_version, load_long_table
+from map_features import TimestampedFeatures
+from render_cache import render_cache
 
 # Load the CSV file
 file_path = 'fc_geoglows_random_20240429.csv'
-data = pd.read_csv(file_path)
+data, warning_level_values = load_long_table(file_path)
+dataset_version = get_dataset_version(file_path)
 
 # Extract unique IDs
 unique_ids = data['Id'].unique().tolist()
 
+# Index the rows and names of each ID once, so selections do not rescan the table
+id_index = GroupIndex(data)
+
+# Map features of every row, built once with vectorized binning and string formatting
+map_features = TimestampedFeatures(data, id_index)
+
 # Reactive variables
 selected_id = solara.reactive(unique_ids[0])
 selected_name = solara.reactive("")
@@ -19,15 +31,11 @@ generate_trigger = solara.reactive(0)
 
 # Function to update name based on selected ID
 def update_state_and_name(id):
-    filtered_data = data[data['Id'] == id]
-    if not filtered_data.empty:
-        selected_name.value = filtered_data['Name'].iloc[0]
-    else:
-        selected_name.value = ""
+    selected_name.value = id_index.first_name(id)
 
 # Function to filter data based on selected ID
 def get_filtered_names(id):
-    filtered_names = data[data['Id'] == id]['Name'].unique().tolist()
+    filtered_names = id_index.get_names(id)
     if filtered_names:
         selected_name.value = filtered_names[0]
     return filtered_names
@@ -39,15 +47,13 @@ def plot_line_chart(df, id):
         print("No data available for the selected ID.")
         return None
 
-    # Ensure date is in datetime format
-    filtered_data['date'] = pd.to_datetime(filtered_data['date'])
-
     fig, ax1 = plt.subplots(figsize=(12, 8))
     ax2 = ax1.twinx()  # Instantiate a second y-axis that shares the same x-axis
 
-    # Plot 51 lines for each ens_mem value with shortened legend labels
+    # Plot 51 lines for each ens_mem value with shortened legend labels, each cut to what the chart width can show
+    width_px = get_figure_width(fig)
     for ens_mem in range(51):
-        ens_mem_data = filtered_data[filtered_data['ens_mem'] == ens_mem]
+        ens_mem_data = downsample_frame(filtered_data[filtered_data['ens_mem'] == ens_mem], 'date', 'value', width_px=width_px)
         ax1.plot(ens_mem_data['date'], ens_mem_data['value'], linestyle='-', alpha=0.5, label=f'em {ens_mem}')
 
     ax1.set_xlabel('Date', fontweight='bold')
@@ -73,8 +79,8 @@ def plot_line_chart(df, id):
     }
 
     for level, (linestyle, color, short_name) in warning_levels.items():
-        if level in df.columns:
-            value = df[level].unique()[0]
+        if id in warning_level_values.index and level in warning_level_values.columns:
+            value = warning_level_values.at[id, level]
             ax2.axhline(y=value, color=color, linestyle=linestyle, label=short_name)
 
     # Adjust legend positioning to be horizontal at the bottom
@@ -110,93 +116,58 @@ def add_legend(m):
      '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
+# Placeholder in the map's stylesheet that a highlight rule replaces
+highlight_placeholder = '/* highlight */'
+
 # Function to plot map with timeline slider
-def plot_map_with_slider(df, highlight_id=None):
+def plot_map_with_slider(features):
     # Create a map centered around the mean coordinates with a specific zoom level
-    m = folium.Map(location=[df['YCoordinate'].mean(), df['XCoordinate'].mean()], zoom_start=4)
-
-    # Define a function to determine color based on value
-    def get_color(value):
-        if value < 10:
-            return 'green'
-        elif 10 <= value < 20:
-            return 'blue'
-        elif 20 <= value < 30:
-            return 'orange'
-        else:
-            return 'red'
+    m = folium.Map(location=features.center, zoom_start=4)
 
-    # Define a function to determine radius based on value
-    def get_radius(value):
-        if value < 10:
-            return 8
-        else:
-            return 10
-
-    features = []
-    for i, row in df.iterrows():
-        feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [row['XCoordinate'], row['YCoordinate']]
-            },
-            'properties': {
-                'time': row['date'],
-                'popup': f"ID: {row['Id']} - {row['Name']}: ({row['XCoordinate']}, {row['YCoordinate']}) Value: {row['value']}",
-                'icon': 'circle',
-                'iconstyle': {
-                    'color': get_color(row['value']),
-                    'fillColor': get_color(row['value']),
-                    'fillOpacity': 0.6,
-                    'radius': get_radius(row['value'])
-                }
-            }
-        }
-        if highlight_id and row['Id'] == highlight_id:
-            # Adding blinking effect for the highlighted ID
-            feature['properties']['iconstyle']['className'] = 'blinking'
-        features.append(feature)
-
-    TimestampedGeoJson({
-        'type': 'FeatureCollection',
-        'features': features
-    }, period='P1D', add_last_point=True, auto_play=False, loop=False).add_to(m)
+    # Features are serialized once at load, each marker tagged with a class name for its ID
+    TimestampedGeoJson(io.StringIO(features.to_json()), period='P1D', add_last_point=True, auto_play=False, loop=False).add_to(m)
 
     # Add legend to the map
     add_legend(m)
 
-    # Add CSS for blinking effect
-    blinking_css = '''
+    # Add CSS for blinking effect; the rule for the highlighted ID's markers goes in place of the placeholder
+    blinking_css = f'''
     <style>
-    .blinking {
-        animation: blinker 1s linear infinite;
-    }
-    @keyframes blinker {
-        50% { opacity: 0; }
-    }
+    @keyframes blinker {{
+        50% {{ opacity: 0; }}
+    }}
+    {highlight_placeholder}
     </style>
     '''
     m.get_root().html.add_child(folium.Element(blinking_css))
 
     return m
 
+_base_map_html = None
+
+# Function to get the map HTML for a highlight: the page is rendered once and a highlight only fills in its CSS rule
+def get_map_html(highlight_id=None):
+    global _base_map_html
+    if _base_map_html is None:
+        _base_map_html = plot_map_with_slider(map_features)._repr_html_()
+    return _base_map_html.replace(highlight_placeholder, html.escape(map_features.highlight_css(highlight_id)), 1)
+
 # Components
 @solara.component
 def View():
     with solara.VBox() as main:
         if generate_trigger.value > 0 and selected_id.value:
-            m = plot_map_with_slider(data, highlight_id=selected_id.value)
-            fig = plot_line_chart(data, selected_id.value)
-            if fig:
-                solara.HTML(tag="div", unsafe_innerHTML=m._repr_html_())
-                solara.FigureMatplotlib(fig)
+            # Repeat views of the same ID reuse the rendered image instead of redrawing 51 ensemble lines
+            chart_png = render_cache.render((dataset_version, 'line', selected_id.value),
+                                            lambda: plot_line_chart(id_index.rows(selected_id.value), selected_id.value))
+            if chart_png:
+                solara.HTML(tag="div", unsafe_innerHTML=get_map_html(selected_id.value))
+                solara.Image(chart_png)
                 solara.Info("Map and chart have been updated.")
             else:
                 solara.Warning("No data available for the selected ID.")
         else:
-            m = plot_map_with_slider(data)
-            solara.HTML(tag="div", unsafe_innerHTML=m._repr_html_())
+            solara.HTML(tag="div", unsafe_innerHTML=get_map_html())
             solara.Warning("Please select an ID.")
     return main
 
@@ -0,0 +1,105 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from ensemble_stats import compute_ensemble_stats
+from forecast_io import read_time_array
+from rivid_index import load_rivid_index, lookup_river_indices
+from store_pool import get_forecast_url, open_forecast_group
+
+# Function run in each worker: read one batch of rivers and write it straight into the shared cube
+def _fill_batch(shm_name, shape, date, bucket_url, rivid_indices, positions):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        cube = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        zarr_group = open_forecast_group(date, bucket_url)
+        qout_array = zarr_group['Qout'].get_orthogonal_selection((slice(None), slice(None), rivid_indices))
+        cube[positions] = qout_array.transpose(2, 1, 0)
+        del cube
+    finally:
+        shm.close()
+    return len(positions)
+
+
+class SharedCube:
+    # River x time x ensemble cube living in the shared memory block the workers filled; close() frees the block
+
+    def __init__(self, shm, shape, river_numbers, time_array, ensemble_array):
+        self.shm = shm
+        self.values = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        self.river_numbers = river_numbers
+        self.time_array = time_array
+        self.ensemble_array = ensemble_array
+
+    def close(self):
+        # Views taken from values keep the mapping alive until they go, but the block's name is removed right away
+        if self.shm is None:
+            return
+        self.values = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        self.shm.unlink()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+# Function to read many rivers for a date on a process pool into one shared river x time x ensemble cube, without copying it out
+def ingest_parallel(river_numbers, date, n_workers=None, batch_size=500, bucket_url=None):
+    zarr_group = open_forecast_group(date, bucket_url)
+
+    # Resolve the rivers in the parent and sort them by rivid position, so each batch reads neighbouring chunks
+    river_numbers = np.asarray(river_numbers)
+    rivid_indices = lookup_river_indices(load_rivid_index(zarr_group, get_forecast_url(date, bucket_url)), river_numbers)
+    found = rivid_indices >= 0
+    river_numbers = river_numbers[found]
+    rivid_indices = rivid_indices[found]
+    order = np.argsort(rivid_indices, kind='stable')
+
+    n_ensembles, n_times = zarr_group['Qout'].shape[:2]
+    shape = (len(river_numbers), n_times, n_ensembles)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 4, 1))
+    try:
+        # Spawned workers avoid forking a parent that already runs s3fs I/O threads
+        n_workers = n_workers or os.cpu_count()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(_fill_batch, shm.name, shape, date, bucket_url,
+                                rivid_indices[order[start:start + batch_size]], order[start:start + batch_size])
+                for start in range(0, len(order), batch_size)
+            ]
+            for future in futures:
+                future.result()
+        time_array = read_time_array(zarr_group)
+        ensemble_array = zarr_group['ensemble'][:]
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    # The caller owns the block from here on and frees it with close() or a with statement
+    return SharedCube(shm, shape, river_numbers, time_array, ensemble_array)
+
+# Function to turn an ingested cube into the same frame layout as RiverDF.get_forecast_data_many; the frame owns its
+# values, so the shared cube can be closed afterwards
+def cube_to_frame(cube, river_numbers, time_array, ensemble_array, date):
+    n_rivers, n_times, n_ensembles = cube.shape
+    forecast_df = pd.DataFrame(cube.reshape(n_rivers * n_times, n_ensembles), columns=[f"ensemble_{i}" for i in ensemble_array], copy=True)
+    forecast_df.index = np.tile(time_array, n_rivers)
+    for name, stat_array in compute_ensemble_stats(cube, axis=2).items():
+        forecast_df[name] = stat_array.ravel()
+    forecast_df['RiverNumber'] = np.repeat(river_numbers, n_times)
+    forecast_df['Date'] = date
+    return forecast_df
@@ -1,30 +1,59 @@
+import json
+import base64
+import numpy as np
 import pandas as pd
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster, MarkerCluster
 import plotly.graph_objects as go
-from datetime import datetime
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from ensemble_stats import stat_columns
+from forecast_io import get_ensemble_columns, list_forecast_dates, read_forecast_dataset
 
-# Load the uploaded CSV files
-forecast_df = pd.read_csv('/Users/sinugp/Downloads/forecast_data.csv')
-coordinates_df = pd.read_csv('/Users/sinugp/Downloads/altair_points_with_river_numbers.csv')
+# With lazy popups the forecasts are written once as a shared blob and each chart is drawn when its popup opens,
+# so the map can hold every river; the eager mode embeds a full Plotly page per marker and stays capped
+lazy_popups = True
+max_rivers = None if lazy_popups else 5
+
+# Where plotly.js comes from in lazy mode: 'cdn' links it once, 'inline' embeds it once for offline viewing
+plotlyjs = 'cdn'
 
-# Ensure Date column is in the correct format
-forecast_df['Date'] = pd.to_datetime(forecast_df['Date'], format='%Y%m%d%H')
+# Load the river coordinates, leaving out points the geocoder could not match to a river
+coordinates_df = pd.read_csv('/Users/sinugp/Downloads/altair_points_with_river_numbers.csv')
+coordinates_df = coordinates_df.dropna(subset=['RiverNumber']).astype({'RiverNumber': 'int64'})
 
-# Filter Data: Select the first 5 RiverNumbers
-unique_river_numbers = coordinates_df['RiverNumber'].unique()[:5]
+# Filter Data: Select the first max_rivers RiverNumbers
+unique_river_numbers = coordinates_df['RiverNumber'].unique()[:max_rivers]
 filtered_coordinates_df = coordinates_df[coordinates_df['RiverNumber'].isin(unique_river_numbers)]
-filtered_forecast_df = forecast_df[forecast_df['RiverNumber'].isin(unique_river_numbers)]
+
+# Load one forecast run (the latest unless a Date partition such as '2024040100' is chosen) for the selected rivers only,
+# so runs from different dates are never drawn as one series
+forecast_dataset_path = '/Users/sinugp/Downloads/forecast_data'
+forecast_date = None
+if forecast_date is None:
+    forecast_dates = list_forecast_dates(forecast_dataset_path)
+    if not forecast_dates:
+        raise ValueError(f'No forecast dates found in {forecast_dataset_path}; write the forecasts with RiverDF.py first')
+    forecast_date = forecast_dates[-1]
+filtered_forecast_df = read_forecast_dataset(forecast_dataset_path, river_numbers=unique_river_numbers, dates=[forecast_date])
 
 # Function to create a Plotly graph and convert it to HTML
 def create_plotly_graph(river_number):
     # Filter forecast data for the specific RiverNumber
     river_data = filtered_forecast_df[filtered_forecast_df['RiverNumber'] == river_number]
     
-    # Create a line plot of the forecast data
+    # Create a fan chart from the precomputed ensemble statistics when they are stored
     fig = go.Figure()
-    for col in river_data.columns[:-2]:  # Exclude RiverNumber and Date columns
-        fig.add_trace(go.Scatter(x=river_data['Date'], y=river_data[col], mode='lines', name=col))
+    if set(stat_columns).issubset(river_data.columns):
+        for low, high, name, color in [('stat_p10', 'stat_p90', 'P10-P90', 'rgba(31, 119, 180, 0.2)'),
+                                       ('stat_p25', 'stat_p75', 'P25-P75', 'rgba(31, 119, 180, 0.4)')]:
+            fig.add_trace(go.Scatter(x=river_data['time'], y=river_data[high], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=river_data['time'], y=river_data[low], mode='lines', line=dict(width=0), fill='tonexty', fillcolor=color, name=name))
+        fig.add_trace(go.Scatter(x=river_data['time'], y=river_data['stat_median'], mode='lines', line=dict(color='rgb(31, 119, 180)'), name='Median'))
+        fig.add_trace(go.Scatter(x=river_data['time'], y=river_data['stat_mean'], mode='lines', line=dict(color='black', dash='dash'), name='Mean'))
+    else:
+        # Otherwise draw one line per ensemble member
+        for col in get_ensemble_columns(river_data):
+            fig.add_trace(go.Scatter(x=river_data['time'], y=river_data[col], mode='lines', name=col))
     
     # Customize the layout
     fig.update_layout(title=f"Forecast for RiverNumber {river_number}", xaxis_title="Date", yaxis_title="Forecast")
@@ -33,20 +62,131 @@ def create_plotly_graph(river_number):
     graph_html = fig.to_html(full_html=False, include_plotlyjs='cdn')
     return graph_html
 
-# Initialize the map with MarkerCluster
+# Series drawn by the fan chart, in the order the popup script reads them
+fan_chart_series = ['stat_p10', 'stat_p90', 'stat_p25', 'stat_p75', 'stat_median', 'stat_mean']
+
+# Function to base64-encode the raw bytes of an array
+def _encode_array(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
+
+# Function to pack the forecasts of every river into one compact blob: float32 series per river, shared time axes.
+# The blob holds one forecast run, so a frame with several Date values is rejected rather than mixed into one series
+def build_forecast_blob(forecast_df):
+    if 'Date' in forecast_df.columns and forecast_df['Date'].nunique() > 1:
+        raise ValueError('build_forecast_blob expects a single forecast Date; read the dataset with dates=[date]')
+    fan_chart = set(stat_columns).issubset(forecast_df.columns)
+    series = fan_chart_series if fan_chart else get_ensemble_columns(forecast_df)
+    forecast_df = forecast_df.sort_values(['RiverNumber', 'time'], kind='stable')
+
+    river_numbers = forecast_df['RiverNumber'].to_numpy()
+    times_ms = pd.to_datetime(forecast_df['time']).to_numpy().astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+    values = forecast_df[series].to_numpy(dtype=np.float32)
+
+    # Rivers read from the same forecast date share a time axis, so each distinct axis is stored once
+    starts = np.flatnonzero(np.r_[True, river_numbers[1:] != river_numbers[:-1]]) if len(river_numbers) else np.array([], dtype=np.int64)
+    stops = np.r_[starts[1:], len(river_numbers)]
+    time_axes = {}
+    rivers = {}
+    for start, stop in zip(starts, stops):
+        axis = time_axes.setdefault(times_ms[start:stop].tobytes(), len(time_axes))
+        rivers[str(int(river_numbers[start]))] = [axis, _encode_array(values[start:stop].T)]
+
+    return {
+        'mode': 'fan' if fan_chart else 'ensemble',
+        'series': series,
+        'times': [base64.b64encode(axis_bytes).decode('ascii') for axis_bytes in time_axes],
+        'rivers': rivers,
+    }
+
+# Script that decodes one river from the blob and draws the same chart as create_plotly_graph into a popup
+popup_chart_script = """
+function decodeRiverArray(encoded, ArrayType) {
+    var binary = atob(encoded);
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) { bytes[i] = binary.charCodeAt(i); }
+    return new ArrayType(bytes.buffer);
+}
+
+function renderRiverChart(riverNumber, element) {
+    var entry = riverForecasts.rivers[String(riverNumber)];
+    if (!entry || element.dataset.rendered) { return; }
+    element.dataset.rendered = '1';
+    var times = Array.from(decodeRiverArray(riverForecasts.times[entry[0]], Float64Array));
+    var values = decodeRiverArray(entry[1], Float32Array);
+    var series = {};
+    riverForecasts.series.forEach(function (name, i) {
+        series[name] = Array.from(values.subarray(i * times.length, (i + 1) * times.length));
+    });
+
+    var traces = [];
+    if (riverForecasts.mode === 'fan') {
+        [['stat_p10', 'stat_p90', 'P10-P90', 'rgba(31, 119, 180, 0.2)'],
+         ['stat_p25', 'stat_p75', 'P25-P75', 'rgba(31, 119, 180, 0.4)']].forEach(function (band) {
+            traces.push({x: times, y: series[band[1]], mode: 'lines', line: {width: 0}, showlegend: false, hoverinfo: 'skip'});
+            traces.push({x: times, y: series[band[0]], mode: 'lines', line: {width: 0}, fill: 'tonexty', fillcolor: band[3], name: band[2]});
+        });
+        traces.push({x: times, y: series['stat_median'], mode: 'lines', line: {color: 'rgb(31, 119, 180)'}, name: 'Median'});
+        traces.push({x: times, y: series['stat_mean'], mode: 'lines', line: {color: 'black', dash: 'dash'}, name: 'Mean'});
+    } else {
+        riverForecasts.series.forEach(function (name) {
+            traces.push({x: times, y: series[name], mode: 'lines', name: name});
+        });
+    }
+    Plotly.newPlot(element, traces, {
+        title: {text: 'Forecast for RiverNumber ' + riverNumber},
+        xaxis: {title: {text: 'Date'}, type: 'date'},
+        yaxis: {title: {text: 'Forecast'}}
+    });
+}
+"""
+
+# Marker callback for FastMarkerCluster: rows are [lat, lon, river number] and the chart is drawn on popupopen
+marker_callback = """
+var callback = function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(String(row[2]));
+    marker.bindPopup('<div class="river-chart" style="width:680px;height:480px"></div>', {maxWidth: 700});
+    marker.on('popupopen', function (e) {
+        renderRiverChart(row[2], e.popup.getElement().querySelector('.river-chart'));
+    });
+    return marker;
+};
+"""
+
+# Function to add every river as a lightweight marker whose chart is drawn from the shared blob when its popup opens
+def add_lazy_popups(m, coordinates_df, forecast_df, plotlyjs='cdn'):
+    if plotlyjs == 'inline':
+        m.get_root().header.add_child(folium.Element(f'<script type="text/javascript">{get_plotlyjs()}</script>'))
+    else:
+        m.get_root().header.add_child(folium.JavascriptLink(f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'))
+
+    blob = json.dumps(build_forecast_blob(forecast_df), separators=(',', ':'))
+    m.get_root().html.add_child(folium.Element(f'<script type="text/javascript">var riverForecasts = {blob};{popup_chart_script}</script>'))
+
+    coordinates_df = coordinates_df.dropna(subset=['RiverNumber'])
+    marker_rows = [[float(lat), float(lon), int(river_number)] for lat, lon, river_number in
+                   zip(coordinates_df['YCoordinate'], coordinates_df['XCoordinate'], coordinates_df['RiverNumber'])]
+    FastMarkerCluster(marker_rows, callback=marker_callback).add_to(m)
+    return m
+
+# Initialize the map
 m = folium.Map(location=[filtered_coordinates_df['YCoordinate'].mean(), filtered_coordinates_df['XCoordinate'].mean()], zoom_start=6)
-marker_cluster = MarkerCluster().add_to(m)
 
-# Add markers to the map with click event to display the forecast plot
-for idx, row in filtered_coordinates_df.iterrows():
-    iframe = folium.IFrame(html=create_plotly_graph(row['RiverNumber']), width=700, height=500)
-    popup = folium.Popup(iframe, max_width=700)
-    
-    folium.Marker(
-        location=[row['YCoordinate'], row['XCoordinate']],
-        popup=popup,
-        tooltip=row['RiverNumber']
-    ).add_to(marker_cluster)
+if lazy_popups:
+    add_lazy_popups(m, filtered_coordinates_df, filtered_forecast_df, plotlyjs=plotlyjs)
+else:
+    marker_cluster = MarkerCluster().add_to(m)
+
+    # Add markers to the map with click event to display the forecast plot
+    for idx, row in filtered_coordinates_df.iterrows():
+        iframe = folium.IFrame(html=create_plotly_graph(row['RiverNumber']), width=700, height=500)
+        popup = folium.Popup(iframe, max_width=700)
+
+        folium.Marker(
+            location=[row['YCoordinate'], row['XCoordinate']],
+            popup=popup,
+            tooltip=row['RiverNumber']
+        ).add_to(marker_cluster)
 
 # Save the map to an HTML file
 map_file_path = '/Users/sinugp/Downloads/interactive_river_map_fixed.html'
@@ -0,0 +1,79 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+# Byte budget for rendered charts kept in memory; 0 turns the cache off
+max_render_bytes = int(os.environ.get('RIVER_ID_RENDER_CACHE_BYTES', 64 * 1024 ** 2))
+
+
+class RenderCache:
+    # Size-bounded LRU of rendered chart bytes, keyed by (dataset version, chart, id, options)
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_render_bytes if max_bytes is None else max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, image_bytes):
+        if len(image_bytes) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key))
+            self.entries[key] = image_bytes
+            self.total_bytes += len(image_bytes)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def render(self, key, plot_func, format='png', dpi=100):
+        # Return cached bytes for the key, or run plot_func, rasterize its figure and keep the result
+        key = (key, format, dpi)
+        image_bytes = self.get(key)
+        if image_bytes is not None:
+            return image_bytes
+        fig = plot_func()
+        if fig is None:
+            return None
+
+        # pyplot is only imported by callers that draw figures, so apps caching other bytes do not load it
+        import matplotlib.pyplot as plt
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=format, dpi=dpi)
+        plt.close(fig)
+        image_bytes = buffer.getvalue()
+        self.put(key, image_bytes)
+        return image_bytes
+
+    def remember(self, key, build_func):
+        # Same as render for content that is already bytes, e.g. a map's HTML
+        image_bytes = self.get(key)
+        if image_bytes is None:
+            image_bytes = build_func()
+            self.put(key, image_bytes)
+        return image_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+# One cache shared by every chart in the process
+render_cache = RenderCache()
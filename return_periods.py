@@ -0,0 +1,75 @@
+import warnings
+import numpy as np
+import pandas as pd
+from forecast_io import get_ensemble_columns
+
+# Warning level columns used by the dashboards, in increasing order of severity
+warning_level_columns = {
+    'ActiveThemeWarningLevelValues_Normal Flow': 'normal',
+    'ActiveThemeWarningLevelValues_2 years Return Period Flow': '2yr',
+    'ActiveThemeWarningLevelValues_5 years Return Period Flow': '5yr',
+    'ActiveThemeWarningLevelValues_10 years Return Period Flow': '10yr',
+    'ActiveThemeWarningLevelValues_15 years Return Period Flow': '15yr',
+    'ActiveThemeWarningLevelValues_20 years Return Period Flow': '20yr',
+}
+
+# Function to get one row of thresholds per Id from a long-format table with warning level columns
+def thresholds_from_long_table(df, id_column='Id'):
+    level_columns = [col for col in warning_level_columns if col in df.columns]
+    thresholds = df.groupby(id_column, sort=False)[level_columns].first()
+    return thresholds.rename(columns=warning_level_columns)
+
+# Function to reshape a forecast frame (a row per river and time) into a river x time x ensemble cube
+def forecast_cube_from_frame(forecast_df):
+    ensemble_columns = get_ensemble_columns(forecast_df)
+    river_numbers = pd.unique(forecast_df['RiverNumber'])
+    n_times = len(forecast_df) // len(river_numbers)
+    cube = forecast_df[ensemble_columns].to_numpy(dtype=np.float32).reshape(len(river_numbers), n_times, len(ensemble_columns))
+    times = forecast_df.index[:n_times]
+    return cube, river_numbers, times
+
+# Function to compare every river's ensemble against its thresholds in one pass
+def compute_exceedance(cube, thresholds, times=None, river_numbers=None, min_probability=0.5):
+    # cube is river x time x ensemble, thresholds is a river x level frame in increasing severity,
+    # in the same river order as the cube unless river_numbers is given to line them up
+    if river_numbers is not None:
+        thresholds = thresholds.reindex(river_numbers)
+    cube = np.asarray(cube, dtype=np.float32)
+    levels = list(thresholds.columns)
+    threshold_values = thresholds.to_numpy(dtype=np.float32)
+    n_rivers, n_times, n_ensembles = cube.shape
+    times = np.arange(n_times) if times is None else np.asarray(times)
+
+    # Count the members with data once, so NaN members do not dilute the probabilities
+    valid_members = np.maximum((~np.isnan(cube)).sum(axis=2), 1)
+    member_peaks = np.where(np.isnan(cube), -np.inf, cube).max(axis=1)
+    n_valid_peaks = np.maximum(np.isfinite(member_peaks).sum(axis=1), 1)
+
+    result = pd.DataFrame(index=thresholds.index)
+    for level_index, level in enumerate(levels):
+        level_thresholds = threshold_values[:, level_index]
+
+        # Share of members whose peak over the horizon reaches the threshold
+        result[f'prob_{level}'] = (member_peaks >= level_thresholds[:, None]).sum(axis=1) / n_valid_peaks
+
+        # First timestep where the share of members over the threshold reaches min_probability
+        step_share = (cube >= level_thresholds[:, None, None]).sum(axis=2) / valid_members
+        reached = step_share >= min_probability
+        first_step = reached.argmax(axis=1)
+        first_time = pd.Series(times[first_step], index=thresholds.index)
+        result[f'first_exceedance_{level}'] = first_time.where(reached.any(axis=1))
+
+    # Peak severity: the highest level reached by the peak of the ensemble median
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        median_peak = np.nanmax(np.nanmedian(cube, axis=2), axis=1)
+    # Code of the highest level reached, not how many were reached: a NaN threshold is not reached but does not shift the levels above it
+    reached = median_peak[:, None] >= threshold_values
+    levels_reached = (reached * np.arange(1, len(levels) + 1)).max(axis=1, initial=0)
+    result['peak_flow'] = median_peak
+    result['peak_severity'] = pd.Categorical.from_codes(levels_reached, ['none'] + levels, ordered=True)
+    return result
+
+# Function to order rivers from most to least at risk
+def rank_at_risk(exceedance, level='2yr'):
+    return exceedance.sort_values(['peak_severity', f'prob_{level}', 'peak_flow'], ascending=False)
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+from longtable_loader import get_dataset_version
+from rivid_index import cache_dir
+
+# Function to parse a column of "[1.0, 2.0, ...]" strings in bulk into a NaN-padded float32 matrix and the list lengths
+def parse_forecast_column(strings):
+    bodies = strings.fillna('').astype(str).str.strip().str.strip('[]').str.strip()
+    lengths = np.where(bodies == '', 0, bodies.str.count(',') + 1).astype(np.int32)
+    joined = ','.join(bodies[lengths > 0])
+    values = np.array(joined.split(','), dtype=np.float32) if joined else np.empty(0, dtype=np.float32)
+
+    # Scatter the flat values into rows, padding shorter forecasts with NaN
+    forecasts = np.full((len(lengths), int(lengths.max()) if len(lengths) else 0), np.nan, dtype=np.float32)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    forecasts[rows, columns] = values
+    return forecasts, lengths
+
+# Function to get the sidecar folder for a river CSV, tied to its size and modification time
+def get_sidecar_dir(csv_path):
+    return os.path.join(cache_dir, 'river_forecasts', get_dataset_version(csv_path))
+
+# Function to write the river table and its forecast matrix as sidecar files that load without parsing
+def build_sidecar(csv_path, forecast_column='ForecastData'):
+    sidecar_dir = get_sidecar_dir(csv_path)
+    df = pd.read_csv(csv_path)
+    forecasts, lengths = parse_forecast_column(df[forecast_column])
+
+    tmp_dir = f'{sidecar_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    df.drop(columns=[forecast_column]).reset_index(drop=True).to_feather(os.path.join(tmp_dir, 'rivers.feather'))
+    np.save(os.path.join(tmp_dir, 'forecasts.npy'), forecasts)
+    np.save(os.path.join(tmp_dir, 'lengths.npy'), lengths)
+    try:
+        os.replace(tmp_dir, sidecar_dir)
+    except OSError:
+        # Another process finished the same sidecar first
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    return sidecar_dir
+
+# Function to load the river table and its forecasts, building the sidecar on first use; mmap_mode='r' maps the matrix read-only
+def load_river_forecasts(csv_path, mmap_mode=None):
+    sidecar_dir = get_sidecar_dir(csv_path)
+    if not os.path.exists(os.path.join(sidecar_dir, 'forecasts.npy')):
+        build_sidecar(csv_path)
+    rivers = pd.read_feather(os.path.join(sidecar_dir, 'rivers.feather'))
+    forecasts = np.load(os.path.join(sidecar_dir, 'forecasts.npy'), mmap_mode=mmap_mode)
+    lengths = np.load(os.path.join(sidecar_dir, 'lengths.npy'), mmap_mode=mmap_mode)
+    return rivers, forecasts, lengths
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+# Local cache directory for the rivid lookup tables, shared by all forecast dates
+cache_dir = os.environ.get('RIVER_ID_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'river_id'))
+
+# Tables already loaded in this process: store URL -> (zarr group, checksum) and checksum -> (sorted_rivid, order)
+_loaded_stores = {}
+_loaded_tables = {}
+_lock = threading.Lock()
+
+# Function to get the folder holding the lookup tables
+def get_index_dir():
+    index_dir = os.path.join(cache_dir, 'rivid_index')
+    os.makedirs(index_dir, exist_ok=True)
+    return index_dir
+
+# Function to get the saved pointer file of a store, named after its full URL so two buckets never share one
+def get_pointer_path(store_url):
+    return os.path.join(get_index_dir(), hashlib.sha1(store_url.rstrip('/').encode()).hexdigest() + '.json')
+
+# Function to build a sorted lookup table from a rivid array
+def build_rivid_index(rivid_array):
+    rivid_array = np.asarray(rivid_array)
+    order = np.argsort(rivid_array, kind='stable')
+    return rivid_array[order], order
+
+# Function to keep a loaded table in memory for as long as the same opened group is in use
+def _remember(store_url, zarr_group, checksum, table):
+    with _lock:
+        table = _loaded_tables.setdefault(checksum, table)
+        _loaded_stores[store_url] = (zarr_group, checksum)
+    return table
+
+# Function to load the lookup table of a forecast store; repeat calls with the same opened group do not touch disk
+def load_rivid_index(zarr_group, store_url):
+    # store_pool imports this module through chunk_cache, so it is imported here rather than at the top
+    from store_pool import read_store_version
+
+    store_url = store_url.rstrip('/')
+    with _lock:
+        loaded = _loaded_stores.get(store_url)
+        if loaded is not None and loaded[0] is zarr_group and loaded[1] in _loaded_tables:
+            return _loaded_tables[loaded[1]]
+
+    # A store seen before points straight at its table, as long as it was not republished since
+    pointer_path = get_pointer_path(store_url)
+    version = read_store_version(store_url)
+    shape = list(zarr_group['rivid'].shape)
+    if os.path.exists(pointer_path):
+        with open(pointer_path) as f:
+            pointer = json.load(f)
+        checksum = pointer['checksum']
+        table_path = os.path.join(get_index_dir(), f'{checksum}.npz')
+        if version is not None and pointer.get('version') == version and pointer.get('shape') == shape:
+            with _lock:
+                table = _loaded_tables.get(checksum)
+            if table is not None:
+                return _remember(store_url, zarr_group, checksum, table)
+            if os.path.exists(table_path):
+                with np.load(table_path) as table:
+                    return _remember(store_url, zarr_group, checksum, (table['sorted_rivid'], table['order']))
+
+    # Otherwise read rivid once and reuse any table with the same checksum from another store
+    rivid_array = np.ascontiguousarray(zarr_group['rivid'][:])
+    checksum = hashlib.sha1(rivid_array.tobytes() + str(rivid_array.dtype).encode()).hexdigest()
+    table_path = os.path.join(get_index_dir(), f'{checksum}.npz')
+    with _lock:
+        cached = _loaded_tables.get(checksum)
+    if cached is not None:
+        sorted_rivid, order = cached
+    elif os.path.exists(table_path):
+        with np.load(table_path) as table:
+            sorted_rivid, order = table['sorted_rivid'], table['order']
+    else:
+        sorted_rivid, order = build_rivid_index(rivid_array)
+        tmp_path = f'{table_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp_path, sorted_rivid=sorted_rivid, order=order)
+        os.replace(tmp_path, table_path)
+
+    tmp_path = f'{pointer_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'store_url': store_url, 'checksum': checksum, 'version': version, 'shape': shape}, f)
+    os.replace(tmp_path, pointer_path)
+    return _remember(store_url, zarr_group, checksum, (sorted_rivid, order))
+
+# Function to drop the saved and in-memory table pointer of a store so its rivid is checked again
+def forget_store_index(store_url):
+    store_url = store_url.rstrip('/')
+    with _lock:
+        loaded = _loaded_stores.pop(store_url, None)
+        if loaded is not None and loaded[1] not in [checksum for _, checksum in _loaded_stores.values()]:
+            _loaded_tables.pop(loaded[1], None)
+    pointer_path = get_pointer_path(store_url)
+    if os.path.exists(pointer_path):
+        os.remove(pointer_path)
+
+# Function to drop every table held in memory, e.g. to time a cold start
+def clear_loaded_indexes():
+    with _lock:
+        _loaded_stores.clear()
+        _loaded_tables.clear()
+
+# Function to find the rivid positions of many river numbers at once, -1 where missing
+def lookup_river_indices(rivid_index, river_numbers):
+    sorted_rivid, order = rivid_index
+    river_numbers = np.asarray(river_numbers, dtype=sorted_rivid.dtype)
+    if len(sorted_rivid) == 0:
+        return np.full(river_numbers.shape, -1, dtype=np.int64)
+    positions = np.searchsorted(sorted_rivid, river_numbers)
+    positions = np.minimum(positions, len(sorted_rivid) - 1)
+    found = sorted_rivid[positions] == river_numbers
+    return np.where(found, order[positions], -1)
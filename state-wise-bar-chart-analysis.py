@@ -2,10 +2,13 @@ import pandas as pd
 import solara
 import matplotlib.pyplot as plt
 import numpy as np
+from longtable_loader import get_dataset_version
+from render_cache import render_cache
 
 # Load the CSV file
 file_path = 'solara-dropdown.csv'
 data = pd.read_csv(file_path)
+dataset_version = get_dataset_version(file_path)
 
 # Extract unique states
 unique_states = data['state'].unique().tolist()
@@ -52,10 +55,12 @@ def plot_bar_chart(df, name):
 @solara.component
 def View():
     if generate_trigger.value > 0 and selected_name.value:
-        fig = plot_bar_chart(data, selected_name.value)
-        if fig:
+        # Repeat views of the same name reuse the rendered image instead of redrawing
+        chart_png = render_cache.render((dataset_version, 'bar', selected_name.value),
+                                        lambda: plot_bar_chart(data, selected_name.value))
+        if chart_png:
             with solara.VBox() as main:
-                solara.FigureMatplotlib(fig)
+                solara.Image(chart_png)
             solara.Info("Chart has been updated.")
         else:
             solara.Warning("No data available for the selected state and name")
@@ -0,0 +1,109 @@
+import os
+import threading
+from collections import OrderedDict
+import fsspec
+import zarr
+from chunk_cache import ChunkCache, clear_cached_store, max_cache_bytes
+from io_metrics import InstrumentedMapper, timed
+from rivid_index import forget_store_index
+
+# Bucket holding the GeoGLOWS forecasts; point it at a local folder of {date}.zarr stores for offline runs
+forecast_bucket_url = os.environ.get('FORECAST_BUCKET_URL', 's3://geoglows-v2-forecasts/')
+
+# Size caps for the process-wide pools
+max_filesystems = 8
+max_zarr_groups = 32
+
+_filesystems = OrderedDict()
+_zarr_groups = OrderedDict()
+_lock = threading.RLock()
+
+# Function to make a hashable pool key from storage options
+def _options_key(storage_options):
+    return tuple(sorted((k, repr(v)) for k, v in storage_options.items()))
+
+# Function to add an entry to a pool, evicting the least recently used one when full
+def _put(pool, key, value, max_size):
+    pool[key] = value
+    pool.move_to_end(key)
+    while len(pool) > max_size:
+        pool.popitem(last=False)
+
+# Function to get a pooled filesystem for a URL, creating it on first use
+def get_filesystem(url, **storage_options):
+    protocol = fsspec.core.split_protocol(url)[0] or 'file'
+    if protocol in ('s3', 's3a') and not storage_options:
+        storage_options = {'anon': True}
+    key = (protocol, _options_key(storage_options))
+    with _lock:
+        if key in _filesystems:
+            _filesystems.move_to_end(key)
+            return _filesystems[key]
+        fs = fsspec.filesystem(protocol, **storage_options)
+        _put(_filesystems, key, fs, max_filesystems)
+        return fs
+
+# Function to get a mapper for a store URL, counting its requests and reading through the on-disk chunk cache when it is on
+def get_mapper(url, **storage_options):
+    fs = get_filesystem(url, **storage_options)
+    mapper = InstrumentedMapper(fs.get_mapper(url.rstrip('/'), check=False), store_path=url.rstrip('/'))
+    if max_cache_bytes > 0:
+        return ChunkCache(mapper, store_path=url.rstrip('/'))
+    return mapper
+
+# Function to open a Zarr group once and hand back the pooled copy on later calls
+def open_zarr_group(url, **storage_options):
+    key = (url.rstrip('/'), _options_key(storage_options))
+    with _lock:
+        if key in _zarr_groups:
+            _zarr_groups.move_to_end(key)
+            return _zarr_groups[key]
+    mapper = get_mapper(url, **storage_options)
+    with timed('open_group', store=url.rstrip('/')):
+        try:
+            # Consolidated stores need a single .zmetadata read
+            zarr_group = zarr.open_consolidated(mapper, mode='r')
+        except KeyError:
+            zarr_group = zarr.open_group(mapper, mode='r')
+    with _lock:
+        _put(_zarr_groups, key, zarr_group, max_zarr_groups)
+    return zarr_group
+
+# Function to get the store URL of the forecast for a date
+def get_forecast_url(date, bucket_url=None):
+    bucket_url = bucket_url or forecast_bucket_url
+    return f"{bucket_url.rstrip('/')}/{date}.zarr"
+
+# Function to open the forecast Zarr group for a date
+def open_forecast_group(date, bucket_url=None):
+    return open_zarr_group(get_forecast_url(date, bucket_url))
+
+# Function to forget a store that changed remotely: its pooled group, its cached chunks and its rivid lookup table
+def forget_store(url):
+    url = url.rstrip('/')
+    with _lock:
+        for key in [key for key in _zarr_groups if key[0] == url]:
+            del _zarr_groups[key]
+    clear_cached_store(url)
+    forget_store_index(url)
+
+# Function to get the version of a store's metadata file from a single metadata request, without reading it
+def read_store_version(url):
+    url = url.rstrip('/')
+    fs = get_filesystem(url)
+    for key in ('.zmetadata', 'Qout/.zarray'):
+        try:
+            path = f'{url}/{key}'
+            fs.invalidate_cache(path)
+            info = fs.info(path)
+            version = info.get('ETag') or info.get('LastModified') or info.get('mtime')
+            return f'{key}:{version}:{info.get("size")}'
+        except FileNotFoundError:
+            continue
+    return None
+
+# Function to drop every pooled filesystem and Zarr group
+def clear_pool():
+    with _lock:
+        _zarr_groups.clear()
+        _filesystems.clear()